@@ -0,0 +1,345 @@
+# ************************************************************************************************************************* #
+#   UTC Header                                                                                                              #
+#                                                         ::::::::::::::::::::       :::    ::: :::::::::::  ::::::::       #
+#      benchmark.py                                       ::::::::::::::::::::       :+:    :+:     :+:     :+:    :+:      #
+#                                                         ::::::::::::::+++#####+++  +:+    +:+     +:+     +:+             #
+#      By: Branly, Tran Quoc <->                          ::+++##############+++     +:+    +:+     +:+     +:+             #
+#      https://github.com/StephaneBranly              +++##############+++::::       +#+    +:+     +#+     +#+             #
+#                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
+#      Update: 2026/10/18 09:45:13 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#                                                                                                                           #
+# ************************************************************************************************************************* #
+
+from OSMPythonTools.overpass import OverpassResult
+import pandas as pd
+import numpy as np
+import argparse
+import datetime
+import platform
+import tempfile
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from .utils import *
+from .clean_data import (
+    convert_to_latlon,
+    convert_to_datetime_format,
+    add_columns_for_date,
+)
+from .distances import calculate_distances, compare_with_exact
+from .distance_raster import LONDON_BBOX
+from .feature_store import features_to_geometries
+from .pipeline import create_cleaning_pipeline
+from .supervised_classification import (
+    cross_validation,
+    prepare_inputs_oe,
+    prepare_targets,
+)
+
+# Scale-ups of the incidents benchmarked for each stage by default
+STAGE_SCALES = {
+    "convert_to_latlon": [1, 10, 100],
+    "add_columns_for_date": [1, 10, 100],
+    "calculate_distances": [1, 10, 100],
+    "cross_validation": [1, 10],
+}
+
+# Overpass responses of the cache used as targets, by target name: polygons (heath, lake, forest, commercial) and lines (river)
+BENCHMARK_TARGETS = {
+    "heath": "069636f336ad914deaa948ac86e9fa288d5e3259",
+    "lake": "1b37ca6bf48bf54b7e5a489fa15de7d374261b79",
+    "forest": "25ec122618aed0503515eb71abb8e0d6b6318218",
+    "river": "d6ae75ff13c188ba500084077faf3949b3e4e43a",
+    "commercial": "790f9af3f56e043f082bd74c1747a8e49f415d8d",
+}
+
+CATEGORICAL_COLUMNS = [
+    "originof_call",
+    "property_type",
+    "property_category",
+    "special_service_type_category",
+    "special_service_type",
+    "borough",
+    "month",
+    "dayofweek",
+]
+
+
+def load_overpass_cache_features(path, key=""):
+    """
+    Load the geometries of an Overpass response saved in the cache, without any request.
+    Relations are skipped, as building their geometry needs the OSM API. Returns the geometries and the number of skipped elements
+    """
+    with open(path) as f:
+        response = json.load(f)["response"]
+    elements = OverpassResult(response, None, None).elements()
+    relations = sum(element.type() == "relation" for element in elements)
+    if relations > 0:
+        print(
+            f"{key} {couleurs.ATTENTION}{relations} relation features skipped offline{couleurs.FIN}"
+        )
+    geometries, _, skipped = features_to_geometries(
+        [element for element in elements if element.type() != "relation"], key
+    )
+    return geometries, relations + skipped
+
+
+def load_benchmark_targets(cache_path="cache/", targets=BENCHMARK_TARGETS):
+    """
+    Load the targets of the benchmark from their Overpass responses in the cache (see BENCHMARK_TARGETS), with the number of features skipped offline
+    """
+    loaded = {}
+    for key, query_hash in targets.items():
+        path = f"{cache_path}/overpass-{query_hash}"
+        if not os.path.exists(path):
+            raise Exception(
+                f"Overpass response of the benchmark target {key} missing: {path}"
+            )
+        geometries, skipped = load_overpass_cache_features(path, key)
+        loaded[key] = {"geometries": geometries, "skipped_features": skipped}
+    return loaded
+
+
+def scale_up(data, factor, random_state=0):
+    """
+    Build a synthetic dataframe of factor times the rows of data, the copies having their coordinates moved by about 50 meters
+    """
+    if factor == 1:
+        return data.copy()
+    rng = np.random.default_rng(random_state)
+    scaled = pd.concat([data] * factor, ignore_index=True)
+    for column, jitter in [
+        ("latitude", 5e-4),
+        ("longitude", 5e-4),
+        ("easting_rounded", 50),
+        ("northing_rounded", 50),
+    ]:
+        if column in scaled:
+            noise = rng.uniform(-jitter, jitter, len(scaled))
+            noise[: len(data)] = 0
+            if scaled[column].dtype.kind in "iu":
+                noise = np.round(noise).astype(scaled[column].dtype)
+            scaled[column] = scaled[column] + noise
+    return scaled
+
+
+def measure(function, make_args, repeats=3):
+    """
+    Run function(*make_args()) repeats times, with new arguments each time, and return the median wall time in seconds and the median peak memory in MB
+    """
+    times = []
+    peaks = []
+    for _ in range(repeats):
+        args = make_args()
+        tracemalloc.start()
+        start_time = time.time()
+        function(*args)
+        times.append(time.time() - start_time)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peaks.append(peak / 2**20)
+    return float(np.median(times)), float(np.median(peaks))
+
+
+def clean_raw_data(raw):
+    """
+    Apply the stages of the cleaning pipeline to the raw incidents, without cache
+    """
+    data = raw.copy()
+    for stage in create_cleaning_pipeline()["stages"]:
+        data = stage["function"](data, **stage["params"])
+    return data
+
+
+def calculate_distances_in_temporary_directory(data, targets):
+    with tempfile.TemporaryDirectory() as save_path:
+        calculate_distances(data, targets, save_path)
+
+
+# Each benchmark prepares the rows of a stage, and returns their number, the function of the stage and a function making its arguments
+def benchmark_convert_to_latlon(raw, scale, targets):
+    data = scale_up(raw, scale)
+    return len(data), convert_to_latlon, lambda: (data.copy(),)
+
+
+def benchmark_add_columns_for_date(raw, scale, targets):
+    data = convert_to_datetime_format(scale_up(raw, scale))
+    return len(data), add_columns_for_date, lambda: (data.copy(),)
+
+
+def benchmark_calculate_distances(raw, scale, targets):
+    data = scale_up(convert_to_latlon(raw.copy()), scale)
+    data = data[data["latitude"].notnull()]
+    return (
+        len(data),
+        calculate_distances_in_temporary_directory,
+        lambda: (data, targets),
+    )
+
+
+def benchmark_cross_validation(raw, scale, targets):
+    data = scale_up(clean_raw_data(raw).dropna(), scale)
+    X = data.drop(columns=["animal_group_parent", "date_time_of_call"])
+    y = data["animal_group_parent"]
+    X_encoded, _, _ = prepare_inputs_oe(X, X, X, X, CATEGORICAL_COLUMNS)
+    y_encoded, _, _ = prepare_targets(y, y, y, y)
+    return (
+        len(data),
+        lambda X, y: cross_validation(X, y, model="KNN", folds=5, hyperparam=5),
+        lambda: (X_encoded, y_encoded),
+    )
+
+
+BENCHMARKS = {
+    "convert_to_latlon": benchmark_convert_to_latlon,
+    "add_columns_for_date": benchmark_add_columns_for_date,
+    "calculate_distances": benchmark_calculate_distances,
+    "cross_validation": benchmark_cross_validation,
+}
+
+
+def run_benchmarks(
+    stages=None,
+    scales=None,
+    data_path="data/animal_rescues.csv",
+    cache_path="cache/",
+    output_path="benchmarks/",
+    repeats=3,
+):
+    """
+    Time and memory profile each stage on the raw incidents of data_path and their synthetic scale-ups (STAGE_SCALES, unless scales is given),
+    keeping the median of repeats runs. The distances are calculated against targets loaded offline from the Overpass cache, without the features whose geometry
+    needs the OSM API (their number is saved with the results). The results are saved as JSON in output_path
+    """
+    raw = pd.read_csv(data_path)
+    targets = load_benchmark_targets(cache_path)
+    results = []
+    for stage in stages or list(BENCHMARKS):
+        for scale in scales or STAGE_SCALES[stage]:
+            rows, function, make_args = BENCHMARKS[stage](raw, scale, targets)
+            seconds, peak_memory_mb = measure(function, make_args, repeats)
+            print(
+                f"--> {stage} x{scale} ({rows} rows) took {couleurs.OKVERT} {round(seconds, 3)} seconds{couleurs.FIN}, peak memory {couleurs.ATTENTION}{round(peak_memory_mb, 1)} MB{couleurs.FIN}"
+            )
+            results.append(
+                {
+                    "stage": stage,
+                    "scale": scale,
+                    "rows": rows,
+                    "seconds": seconds,
+                    "peak_memory_mb": peak_memory_mb,
+                }
+            )
+
+    run = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "repeats": repeats,
+        "targets": {
+            key: {
+                "features": len(targets[key]["geometries"]),
+                "skipped_features": targets[key]["skipped_features"],
+            }
+            for key in targets
+        },
+        "results": results,
+    }
+    if output_path:
+        os.makedirs(output_path, exist_ok=True)
+        path = f"{output_path}/benchmark_{run['date'].replace(':', '-')}.json"
+        with open(path, "w") as f:
+            json.dump(run, f, indent=4)
+    return run
+
+
+def check_simplification_bound(
+    targets, max_errors=(5, 20, 50), n_points=1000, random_state=0
+):
+    """
+    Check with compare_with_exact that the distances of the shapes simplified within max_error meters deviate by at most max_error,
+    for each target on random points of London. The bound holds against the unsimplified shapes in the same metric plane,
+    not against the default distances (max_error=None) whose change is only printed. Returns the reports of the failing checks
+    """
+    rng = np.random.default_rng(random_state)
+    south, west, north, east = LONDON_BBOX
+    latitudes = rng.uniform(south, north, n_points)
+    longitudes = rng.uniform(west, east, n_points)
+    failures = []
+    for key in targets:
+        for max_error in max_errors:
+            report = compare_with_exact(
+                targets[key]["geometries"], latitudes, longitudes, "index", max_error
+            )
+            if report["max_deviation"] > max_error + 1e-6:
+                print(
+                    f"{couleurs.KO}Simplification bound exceeded{couleurs.FIN} {key} : {round(report['max_deviation'], 3)} m for max error {max_error} m"
+                )
+                failures.append({"target": key, **report})
+    return failures
+
+
+def load_last_benchmark(output_path="benchmarks/", before=None):
+    """
+    Load the last benchmark run saved in output_path, optionally the last one before a date
+    """
+    runs = []
+    for path in sorted(glob.glob(f"{output_path}/benchmark_*.json")):
+        with open(path) as f:
+            runs.append(json.load(f))
+    runs = [run for run in runs if before is None or run["date"] < before]
+    return runs[-1] if len(runs) > 0 else None
+
+
+def compare_benchmarks(run, baseline, threshold=0.2):
+    """
+    Compare the results of a run to a baseline run, stage by stage and scale by scale.
+    A regression is flagged when the time or the peak memory grows by more than threshold (relative)
+    """
+    columns = ["stage", "scale", "seconds", "peak_memory_mb"]
+    comparison = pd.merge(
+        pd.DataFrame(run["results"])[columns],
+        pd.DataFrame(baseline["results"])[columns],
+        on=["stage", "scale"],
+        suffixes=("", "_baseline"),
+    )
+    comparison["time_ratio"] = comparison["seconds"] / comparison["seconds_baseline"]
+    comparison["memory_ratio"] = (
+        comparison["peak_memory_mb"] / comparison["peak_memory_mb_baseline"]
+    )
+    comparison["regression"] = (comparison["time_ratio"] > 1 + threshold) | (
+        comparison["memory_ratio"] > 1 + threshold
+    )
+    for row in comparison[comparison["regression"]].itertuples():
+        print(
+            f"{couleurs.KO}Regression{couleurs.FIN} {row.stage} x{row.scale} : time x{round(row.time_ratio, 2)}, memory x{round(row.memory_ratio, 2)}"
+        )
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the distance, cleaning and classification stages, and compare with the last run"
+    )
+    parser.add_argument("--stages", nargs="+", choices=list(BENCHMARKS))
+    parser.add_argument("--scales", nargs="+", type=int)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default="benchmarks/")
+    args = parser.parse_args()
+    run = run_benchmarks(
+        args.stages, args.scales, output_path=args.output, repeats=args.repeats
+    )
+    failed = len(check_simplification_bound(load_benchmark_targets())) > 0
+    baseline = load_last_benchmark(args.output, before=run["date"])
+    if baseline is not None:
+        comparison = compare_benchmarks(run, baseline, args.threshold)
+        failed = failed or comparison["regression"].any()
+    sys.exit(1 if failed else 0)
@@ -8,31 +8,51 @@
 #                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
 #                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
 #                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
-#      Update: 2022/05/31 18:38:56 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#      Update: 2026/10/18 08:56:46 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
 #                                                                                                                           #
 # ************************************************************************************************************************* #
 
+import pyarrow.parquet as pq
+import pyarrow as pa
 import pandas as pd
+import numpy as np
+from pandas.tseries.holiday import (
+    AbstractHolidayCalendar,
+    Holiday,
+    GoodFriday,
+    EasterMonday,
+    next_monday,
+    next_monday_or_tuesday,
+)
+from pandas.tseries.offsets import DateOffset
+from dateutil.relativedelta import MO
+import functools
 import pyproj
 
 from .utils import *
+from .temporal_transformation import add_cyclic_columns
+
+
+@functools.lru_cache()
+def get_transformer(crs_from="epsg:27700", crs_to="epsg:4326"):
+    """
+    Get the pyproj Transformer between two CRS, built once and cached. By default from British National Grid to WGS84 (latitude, longitude)
+    """
+    return pyproj.Transformer.from_crs(crs_from, crs_to)
 
 
 def convert_to_latlon(data):
     """
     Transform the dataframe to add a latitude and longitude column for each row, eventually calculated from other columns
     """
-    bng = pyproj.Proj("epsg:27700")
-    wgs84 = pyproj.Proj("epsg:4326")
-
-    for index, row in data.iterrows():
-        if pd.isnull(row["latitude"]):
-            if row["easting_rounded"]:
-                lat, lon = pyproj.transform(
-                    bng, wgs84, row["easting_rounded"], row["northing_rounded"]
-                )
-                data.at[index, "latitude"] = lat
-                data.at[index, "longitude"] = lon
+    to_convert = data["latitude"].isnull() & data["easting_rounded"].astype(bool)
+    if to_convert.any():
+        lat, lon = get_transformer().transform(
+            data.loc[to_convert, "easting_rounded"].to_numpy(dtype=float),
+            data.loc[to_convert, "northing_rounded"].to_numpy(dtype=float),
+        )
+        data.loc[to_convert, "latitude"] = lat.astype(data["latitude"].dtype)
+        data.loc[to_convert, "longitude"] = lon.astype(data["longitude"].dtype)
 
     # delete needless features
     for key in ["easting_rounded", "northing_rounded", "easting_m", "northing_m"]:
@@ -59,28 +79,36 @@ def convert_to_datetime_format(data):
     return data
 
 
-def remove_incoherent_values(data):
+def remove_incoherent_values(data, inplace=False):
     """
     Remove incoherent values, seen for a low latitude compared to London's Latitude
     """
+    if inplace:
+        data.drop(index=data.index[~(data["latitude"] > 30)], inplace=True)
+        return data
     return data[data["latitude"] > 30]
 
 
-def remove_duplicate_values(data):
+def remove_duplicate_values(data, inplace=False):
     """
     Remove duplicate values in the dataframe
     """
+    if inplace:
+        data.drop_duplicates(inplace=True)
+        return data
     data = data.drop_duplicates()
     return data
 
 
-def remove_unused_columns(data):
+def remove_unused_columns(data, keep_incident_number=False):
     """
-    Remove unused columns bases on the correlation table and data analyse
+    Remove unused columns bases on the correlation table and data analyse.
+    incident_number can be kept as an identifier of the incidents, ie: for calculate_distances_incremental
     """
     # Based on correlation table, we see that incident_number, uprn, usrn has low relation with other variables.
     # These parameters are indepentdent and no strong affected to data performance, so we can ignore it
-    data = delete_feature(data, "incident_number")
+    if not keep_incident_number:
+        data = delete_feature(data, "incident_number")
     data = delete_feature(data, "type_of_incident")
 
     data = delete_feature(data, "cal_year")
@@ -109,49 +137,154 @@ def remove_unused_columns(data):
     return data
 
 
-def add_columns_for_date(data):
-    """
-    Add columns to divide the date into multiple numerical and categorical columns
-    """
-    month_type = pd.CategoricalDtype(
-        categories=[
-            "January",
-            "February",
-            "March",
-            "April",
-            "May",
-            "June",
-            "July",
-            "August",
-            "September",
-            "October",
-            "November",
-            "December",
-        ],
-        ordered=True,
-    )
+month_type = pd.CategoricalDtype(
+    categories=[month_dic[month] for month in range(1, 13)], ordered=True
+)
+day_type = pd.CategoricalDtype(
+    categories=[dayofweek_dic[day] for day in range(7)], ordered=True
+)
+
+# Bank holidays of England and Wales, without the one-off ones (jubilees, royal weddings)
+bank_holidays = AbstractHolidayCalendar(
+    name="England",
+    rules=[
+        Holiday("New Year's Day", month=1, day=1, observance=next_monday),
+        GoodFriday,
+        EasterMonday,
+        Holiday("Early May", month=5, day=1, offset=DateOffset(weekday=MO(1))),
+        Holiday("Spring", month=5, day=31, offset=DateOffset(weekday=MO(-1))),
+        Holiday("Summer", month=8, day=31, offset=DateOffset(weekday=MO(-1))),
+        Holiday("Christmas Day", month=12, day=25, observance=next_monday),
+        Holiday("Boxing Day", month=12, day=26, observance=next_monday_or_tuesday),
+    ],
+)
 
-    day_type = pd.CategoricalDtype(
-        categories=[
-            "Monday",
-            "Tuesday",
-            "Wednesday",
-            "Thursday",
-            "Friday",
-            "Saturday",
-            "Sunday",
-        ],
-        ordered=True,
-    )
 
-    data["year"] = data["date_time_of_call"].dt.year
-    data["month"] = data["date_time_of_call"].dt.month
-    data["dayofweek"] = data["date_time_of_call"].dt.day_of_week
+def get_date_codes(values, shift=0):
+    """
+    Get the integer codes of a date part (month, day of week), missing values coded -1
+    """
+    codes = values.to_numpy(dtype=float, na_value=np.nan) - shift
+    return np.nan_to_num(codes, nan=-1).astype(np.int8)
 
-    data = data.replace({"month": month_dic})
-    data = data.replace({"dayofweek": dayofweek_dic})
-    data["hour"] = data["date_time_of_call"].dt.hour
-    data["month"] = data["month"].astype(month_type)
-    data["dayofweek"] = data["dayofweek"].astype(day_type)
 
+def add_columns_for_date(data, week_of_year=False, holidays=False, cyclic=False):
+    """
+    Add columns to divide the date into multiple numerical and categorical columns.
+    The month and dayofweek categoricals are built from their integer codes, without copying the dataframe.
+    Optionally add the ISO week of the year, a flag of the bank holidays, and the cos and sin columns of the cyclic columns
+    """
+    dates = data["date_time_of_call"].dt
+    data["year"] = dates.year
+    data["month"] = pd.Categorical.from_codes(
+        get_date_codes(dates.month, 1), dtype=month_type
+    )
+    data["dayofweek"] = pd.Categorical.from_codes(
+        get_date_codes(dates.day_of_week), dtype=day_type
+    )
+    data["hour"] = dates.hour
+
+    if week_of_year:
+        data["weekofyear"] = dates.isocalendar().week
+    if holidays:
+        days = dates.normalize()
+        data["holiday"] = days.isin(bank_holidays.holidays(days.min(), days.max()))
+    if cyclic:
+        add_cyclic_columns(data)
     return data
+
+
+# Columns of the raw csv kept by the cleaning, with the coordinates used by convert_to_latlon
+RETAINED_COLUMNS = [
+    "date_time_of_call",
+    "pump_count",
+    "incident_notional_cost",
+    "animal_group_parent",
+    "originof_call",
+    "property_type",
+    "property_category",
+    "special_service_type_category",
+    "special_service_type",
+    "borough",
+    "easting_rounded",
+    "northing_rounded",
+    "latitude",
+    "longitude",
+]
+
+COMPACT_DTYPES = {
+    "pump_count": "float32",
+    "incident_notional_cost": "float32",
+    "originof_call": "category",
+    "property_type": "category",
+    "property_category": "category",
+    "special_service_type_category": "category",
+    "special_service_type": "category",
+    "borough": "category",
+    "easting_rounded": "float32",
+    "northing_rounded": "float32",
+    "latitude": "float32",
+    "longitude": "float32",
+}
+
+
+def clean_chunk(data, seen_hashes):
+    """
+    Apply the cleaning stages to a chunk of the raw data. seen_hashes is the sorted array of the hashes of the rows of the previous chunks, to remove the duplicates between chunks.
+    Returns the cleaned chunk and the updated hashes
+    """
+    data = convert_to_latlon(data)
+    data = lower_case_animal_type(data)
+    data = convert_to_datetime_format(data)
+    data = remove_incoherent_values(data, inplace=True)
+    data = remove_duplicate_values(data, inplace=True)
+
+    hashes = pd.util.hash_pandas_object(data, index=False).to_numpy()
+    data = data[~np.isin(hashes, seen_hashes)]
+    seen_hashes = np.union1d(seen_hashes, hashes)
+
+    data = remove_unused_columns(data)
+    data = add_columns_for_date(data)
+    return data, seen_hashes
+
+
+def get_chunk_table(data):
+    """
+    Convert a cleaned chunk to an arrow table whose schema does not depend on the categories found in the chunk
+    """
+    table = pa.Table.from_pandas(data, preserve_index=True)
+    fields = []
+    for field in table.schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(
+                pa.dictionary(pa.int32(), field.type.value_type, field.type.ordered)
+            )
+        fields.append(field)
+    return table.cast(pa.schema(fields, metadata=table.schema.metadata))
+
+
+def clean_data_in_chunks(
+    path, output_path, chunksize=100000, usecols=RETAINED_COLUMNS, dtype=None
+):
+    """
+    Clean the raw csv file by chunks and write the result incrementally, in csv or parquet depending on the output_path extension.
+    Only the retained columns are read, with compact dtypes (categories, float32), so the memory only grows by the 8 bytes hash kept per row to remove the duplicates.
+    Returns the number of rows written
+    """
+    dtype = COMPACT_DTYPES if dtype is None else dtype
+    seen_hashes = np.empty(0, dtype=np.uint64)
+    writer = None
+    rows = 0
+    for chunk in pd.read_csv(path, usecols=usecols, dtype=dtype, chunksize=chunksize):
+        chunk, seen_hashes = clean_chunk(chunk, seen_hashes)
+        if output_path.endswith(".parquet"):
+            table = get_chunk_table(chunk)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+        else:
+            chunk.to_csv(output_path, mode="w" if rows == 0 else "a", header=rows == 0)
+        rows += len(chunk)
+    if writer is not None:
+        writer.close()
+    return rows
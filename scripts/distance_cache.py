@@ -0,0 +1,110 @@
+# ************************************************************************************************************************* #
+#   UTC Header                                                                                                              #
+#                                                         ::::::::::::::::::::       :::    ::: :::::::::::  ::::::::       #
+#      distance_cache.py                                  ::::::::::::::::::::       :+:    :+:     :+:     :+:    :+:      #
+#                                                         ::::::::::::::+++#####+++  +:+    +:+     +:+     +:+             #
+#      By: Branly, Tran Quoc <->                          ::+++##############+++     +:+    +:+     +:+     +:+             #
+#      https://github.com/StephaneBranly              +++##############+++::::       +#+    +:+     +#+     +#+             #
+#                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
+#      Update: 2026/10/18 09:44:16 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#                                                                                                                           #
+# ************************************************************************************************************************* #
+
+from collections import OrderedDict
+import numpy as np
+import pickle
+import os
+
+
+def create_distance_cache(resolution=None, max_size=1000000, path=None):
+    """
+    Create a LRU cache of nearest element distances, keyed by target and exact coordinates, so that only duplicate locations are reused.
+    With resolution (degrees), the coordinates are quantized on a grid and all the points of a cell get the distance of the first one computed:
+    the error is at most the cell diagonal (1.3 m at 1e-5 in London) for the metric distances (max_error or raster),
+    but the default distances are discontinuous where the nearest point in the longitude/latitude plane switches, and can differ by tens of meters.
+    If path is given, the entries saved by a previous run with the same resolution are loaded
+    """
+    cache = {
+        "resolution": resolution,
+        "max_size": max_size,
+        "path": path,
+        "entries": OrderedDict(),
+        "hits": 0,
+        "misses": 0,
+    }
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            saved = pickle.load(f)
+        if saved["resolution"] == resolution:
+            cache["entries"] = saved["entries"]
+            evict_cache_entries(cache)
+    return cache
+
+
+def save_distance_cache(cache):
+    """
+    Save the entries of the cache to its path, to reuse them in the next runs
+    """
+    if cache["path"]:
+        with open(cache["path"], "wb") as f:
+            pickle.dump(
+                {"resolution": cache["resolution"], "entries": cache["entries"]}, f
+            )
+
+
+def evict_cache_entries(cache):
+    """
+    Remove the least recently used entries above the maximum size of the cache
+    """
+    entries = cache["entries"]
+    while len(entries) > cache["max_size"]:
+        entries.popitem(last=False)
+
+
+def cached_distances(cache, target_id, latitudes, longitudes, compute):
+    """
+    Get the distances for the points from the cache, computing them with compute(latitudes, longitudes) at the first point of each location (or grid cell) not cached yet.
+    Points with missing coordinates get NaN and are never cached.
+    Returns the distances, the number of points found in the cache before the call (hits) and the number of points computed (misses)
+    """
+    resolution = cache["resolution"]
+    entries = cache["entries"]
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    finite = np.isfinite(latitudes) & np.isfinite(longitudes)
+    latitudes = latitudes[finite]
+    longitudes = longitudes[finite]
+    cells = np.column_stack([latitudes, longitudes])
+    if resolution is not None:
+        cells = np.round(cells / resolution).astype(np.int64)
+    unique_cells, first, inverse = np.unique(
+        cells, axis=0, return_index=True, return_inverse=True
+    )
+    keys = [(target_id, lat, lon) for lat, lon in unique_cells.tolist()]
+
+    cell_distances = np.empty(len(keys))
+    cached = np.zeros(len(keys), dtype=bool)
+    for i, key in enumerate(keys):
+        if key in entries:
+            entries.move_to_end(key)
+            cell_distances[i] = entries[key]
+            cached[i] = True
+
+    missing = np.flatnonzero(~cached)
+    if len(missing) > 0:
+        computed = compute(latitudes[first[missing]], longitudes[first[missing]])
+        cell_distances[missing] = computed
+        for i, distance in zip(missing, computed):
+            entries[keys[i]] = distance
+        evict_cache_entries(cache)
+
+    inverse = inverse.reshape(-1)
+    distances = np.full(len(finite), np.nan)
+    distances[finite] = cell_distances[inverse]
+    hits = int(np.sum(cached[inverse]))
+    misses = len(inverse) - hits
+    cache["hits"] += hits
+    cache["misses"] += misses
+    return distances, hits, misses
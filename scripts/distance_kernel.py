@@ -0,0 +1,159 @@
+# ************************************************************************************************************************* #
+#   UTC Header                                                                                                              #
+#                                                         ::::::::::::::::::::       :::    ::: :::::::::::  ::::::::       #
+#      distance_kernel.py                                 ::::::::::::::::::::       :+:    :+:     :+:     :+:    :+:      #
+#                                                         ::::::::::::::+++#####+++  +:+    +:+     +:+     +:+             #
+#      By: Branly, Tran Quoc <->                          ::+++##############+++     +:+    +:+     +:+     +:+             #
+#      https://github.com/StephaneBranly              +++##############+++::::       +#+    +:+     +#+     +#+             #
+#                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
+#      Update: 2026/10/18 08:53:04 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#                                                                                                                           #
+# ************************************************************************************************************************* #
+
+import numpy as np
+
+# Same mean earth radius as the haversine package, in meters
+EARTH_RADIUS = 6371008.8
+
+# Maximum number of (point, vertex) pairs computed at once, to bound the memory used by a block
+MAX_BLOCK_SIZE = 2**20
+
+
+def haversine_distances(lat1, lon1, lat2, lon2):
+    """
+    Get the great-circle distances in meters between two arrays of (latitude, longitude) points, with numpy broadcasting
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    lat = lat2 - lat1
+    lon = lon2 - lon1
+    d = np.sin(lat * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(lon * 0.5) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(d))
+
+
+def get_chunk_size(n_items, max_block_size=MAX_BLOCK_SIZE):
+    """
+    Get the number of points to process at once against n_items vertices or segments
+    """
+    return max(1, max_block_size // max(1, n_items))
+
+
+def nearest_vertex_distances(points, vertices, max_block_size=MAX_BLOCK_SIZE):
+    """
+    Get for each (latitude, longitude) point of an (N,2) array the distance in meters to the nearest vertex of an (M,2) array, and its index
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+    distances = np.full(len(points), np.inf)
+    indices = np.full(len(points), -1)
+    if len(vertices) == 0:
+        return distances, indices
+
+    chunk_size = get_chunk_size(len(vertices), max_block_size)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start : start + chunk_size]
+        block = haversine_distances(
+            chunk[:, 0, None],
+            chunk[:, 1, None],
+            vertices[None, :, 0],
+            vertices[None, :, 1],
+        )
+        nearest = np.argmin(block, axis=1)
+        indices[start : start + chunk_size] = nearest
+        distances[start : start + chunk_size] = block[np.arange(len(chunk)), nearest]
+    return distances, indices
+
+
+def rings_to_segments(rings):
+    """
+    Get the (K,4) array of segments (lat1, lon1, lat2, lon2) of a list of (lon, lat) coordinates rings, and the index of the ring of each segment
+    """
+    segments = []
+    owners = []
+    for i, ring in enumerate(rings):
+        coords = np.asarray(ring, dtype=float).reshape(-1, 2)[:, ::-1]
+        if len(coords) < 2:
+            continue
+        segments.append(np.hstack([coords[:-1], coords[1:]]))
+        owners.append(np.full(len(coords) - 1, i))
+    if len(segments) == 0:
+        return np.empty((0, 4)), np.empty(0, dtype=int)
+    return np.vstack(segments), np.concatenate(owners)
+
+
+def nearest_segment_distances(
+    points, segments, owners=None, max_block_size=MAX_BLOCK_SIZE
+):
+    """
+    Get for each (latitude, longitude) point of an (N,2) array the distance in meters to the nearest shape made of segments of a (K,4) array, the index of this shape and the nearest point on it.
+    As shapely nearest_points does, the nearest point of each shape is found in the longitude/latitude plane before the haversine distance is computed.
+    The segments of a shape must be contiguous, owners gives the shape index of each segment (a single shape by default)
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+    distances = np.full(len(points), np.inf)
+    indices = np.full(len(points), -1)
+    nearest_points = np.full((len(points), 2), np.nan)
+    if len(segments) == 0:
+        return distances, indices, nearest_points
+
+    if owners is None:
+        owners = np.zeros(len(segments), dtype=int)
+    owners = np.asarray(owners)
+    group_starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(owners)])
+    segment_ids = np.arange(len(segments))
+
+    start_points = segments[None, :, 0:2]
+    directions = segments[None, :, 2:4] - segments[None, :, 0:2]
+    squared_lengths = np.sum(directions**2, axis=2)
+    squared_lengths[squared_lengths == 0] = 1
+
+    chunk_size = get_chunk_size(len(segments), max_block_size)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start : start + chunk_size, None, :]
+        rows = np.arange(len(chunk))[:, None]
+        t = np.sum((chunk - start_points) * directions, axis=2) / squared_lengths
+        projections = start_points + np.clip(t, 0, 1)[:, :, None] * directions
+        planar = np.sum((projections - chunk) ** 2, axis=2)
+
+        # nearest segment of each shape in the longitude/latitude plane
+        shape_min = np.minimum.reduceat(planar, group_starts, axis=1)
+        is_min = planar == np.repeat(shape_min, group_sizes, axis=1)
+        shape_segments = np.minimum.reduceat(
+            np.where(is_min, segment_ids, len(segments)), group_starts, axis=1
+        )
+        shape_points = projections[rows, shape_segments]
+        block = haversine_distances(
+            chunk[:, :, 0], chunk[:, :, 1], shape_points[:, :, 0], shape_points[:, :, 1]
+        )
+
+        nearest = np.argmin(block, axis=1)
+        rows = rows[:, 0]
+        indices[start : start + chunk_size] = owners[group_starts[nearest]]
+        distances[start : start + chunk_size] = block[rows, nearest]
+        nearest_points[start : start + chunk_size] = shape_points[rows, nearest]
+    return distances, indices, nearest_points
+
+
+def bbox_lower_bound_distances(latitude, longitude, bounds):
+    """
+    Get a lower bound of the distance in meters between a point and any point of each (minx, miny, maxx, maxy) longitude/latitude bounding box of an (M,4) array.
+    The gap in latitude is exact, the gap in longitude is shrunk at the highest latitude of the point and the box, and both are lowered by 1% for the curvature
+    """
+    bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+    gap_latitude = np.maximum(
+        np.maximum(bounds[:, 1] - latitude, latitude - bounds[:, 3]), 0
+    )
+    gap_longitude = np.maximum(
+        np.maximum(bounds[:, 0] - longitude, longitude - bounds[:, 2]), 0
+    )
+    max_latitude = np.minimum(
+        np.maximum(
+            np.abs(latitude), np.maximum(np.abs(bounds[:, 1]), np.abs(bounds[:, 3]))
+        ),
+        90.0,
+    )
+    gap = np.maximum(gap_latitude, gap_longitude * np.cos(np.radians(max_latitude)))
+    return EARTH_RADIUS * np.radians(gap) * 0.99
@@ -0,0 +1,208 @@
+# ************************************************************************************************************************* #
+#   UTC Header                                                                                                              #
+#                                                         ::::::::::::::::::::       :::    ::: :::::::::::  ::::::::       #
+#      distance_raster.py                                 ::::::::::::::::::::       :+:    :+:     :+:     :+:    :+:      #
+#                                                         ::::::::::::::+++#####+++  +:+    +:+     +:+     +:+             #
+#      By: Branly, Tran Quoc <->                          ::+++##############+++     +:+    +:+     +:+     +:+             #
+#      https://github.com/StephaneBranly              +++##############+++::::       +#+    +:+     +#+     +#+             #
+#                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
+#      Update: 2026/10/18 09:42:47 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#                                                                                                                           #
+# ************************************************************************************************************************* #
+
+from scipy.ndimage import distance_transform_edt
+import numpy as np
+import shapely
+import json
+import math
+import os
+
+from .distance_kernel import EARTH_RADIUS
+from .spatial_index import (
+    build_feature_index,
+    get_index_fingerprint,
+    query_nearest_distances,
+)
+
+# Bounding box (south, west, north, east) of the incidents of the London Fire Brigade
+LONDON_BBOX = (51.28, -0.57, 51.70, 0.48)
+
+
+def get_raster_grid(bbox=LONDON_BBOX, resolution=25, margin=2000):
+    """
+    Get the grid of a raster: nodes every resolution meters over the bounding box widened by margin meters.
+    The longitude step is exact at the middle latitude of the box
+    """
+    south, west, north, east = bbox
+    meters_per_degree = np.radians(1) * EARTH_RADIUS
+    middle_latitude = (south + north) / 2
+    step_latitude = resolution / meters_per_degree
+    step_longitude = resolution / (
+        meters_per_degree * np.cos(np.radians(middle_latitude))
+    )
+    south -= margin / resolution * step_latitude
+    north += margin / resolution * step_latitude
+    west -= margin / resolution * step_longitude
+    east += margin / resolution * step_longitude
+    return {
+        "bbox": list(bbox),
+        "resolution": resolution,
+        "margin": margin,
+        "south": south,
+        "west": west,
+        "step_latitude": step_latitude,
+        "step_longitude": step_longitude,
+        "shape": [
+            int(math.ceil((north - south) / step_latitude)) + 1,
+            int(math.ceil((east - west) / step_longitude)) + 1,
+        ],
+    }
+
+
+def get_grid_positions(grid, latitudes, longitudes):
+    """
+    Get the fractional row and column of points in the grid
+    """
+    rows = (np.asarray(latitudes, dtype=float) - grid["south"]) / grid["step_latitude"]
+    cols = (np.asarray(longitudes, dtype=float) - grid["west"]) / grid["step_longitude"]
+    return rows, cols
+
+
+def mark_nodes(marked, grid, latitudes, longitudes):
+    """
+    Mark the nodes of the grid nearest to the points inside it
+    """
+    rows, cols = get_grid_positions(grid, latitudes, longitudes)
+    rows = np.round(rows)
+    cols = np.round(cols)
+    inside = (
+        (rows >= 0) & (rows < marked.shape[0]) & (cols >= 0) & (cols < marked.shape[1])
+    )
+    marked[rows[inside].astype(int), cols[inside].astype(int)] = True
+
+
+def rasterize_index(index, grid):
+    """
+    Mark the nodes of the grid covered by the shapes of a feature index: points, boundaries and lines sampled every half step, and nodes inside the polygons
+    """
+    marked = np.zeros(grid["shape"], dtype=bool)
+    mark_nodes(marked, grid, index["vertices"][:, 0], index["vertices"][:, 1])
+
+    geometries = index["geometries"]
+    step = min(grid["step_latitude"], grid["step_longitude"]) / 2
+    is_polygon = shapely.get_type_id(geometries) == shapely.GeometryType.POLYGON
+    boundaries = np.where(is_polygon, shapely.boundary(geometries), geometries)
+    boundaries = shapely.segmentize(boundaries, step)
+    coordinates = shapely.get_coordinates(boundaries)
+    mark_nodes(marked, grid, coordinates[:, 1], coordinates[:, 0])
+
+    for polygon in geometries[is_polygon]:
+        minx, miny, maxx, maxy = shapely.bounds(polygon)
+        (row_min, row_max), (col_min, col_max) = get_grid_positions(
+            grid, [miny, maxy], [minx, maxx]
+        )
+        rows = np.arange(
+            max(0, math.ceil(row_min)), min(grid["shape"][0], math.floor(row_max) + 1)
+        )
+        cols = np.arange(
+            max(0, math.ceil(col_min)), min(grid["shape"][1], math.floor(col_max) + 1)
+        )
+        if len(rows) == 0 or len(cols) == 0:
+            continue
+        latitudes = grid["south"] + rows * grid["step_latitude"]
+        longitudes = grid["west"] + cols * grid["step_longitude"]
+        inside = shapely.contains_xy(polygon, longitudes[None, :], latitudes[:, None])
+        marked[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1] |= inside
+    return marked
+
+
+def build_distance_raster(index, path, bbox=LONDON_BBOX, resolution=25, margin=2000):
+    """
+    Build the raster of the distance in meters from each node of the grid to the nearest feature of the index (see build_feature_index),
+    by euclidean distance transform of the rasterized features, and save it as a .npy file memory-mapped by load_distance_raster, with its grid in a .json file.
+    Features farther than margin meters outside the bounding box are ignored
+    """
+    grid = get_raster_grid(bbox, resolution, margin)
+    grid["fingerprint"] = get_index_fingerprint(index)
+    marked = rasterize_index(index, grid)
+
+    raster = np.lib.format.open_memmap(
+        f"{path}.npy", mode="w+", dtype=np.float32, shape=tuple(grid["shape"])
+    )
+    if marked.any():
+        raster[:] = distance_transform_edt(~marked, sampling=resolution)
+    else:
+        raster[:] = np.inf
+    raster.flush()
+    with open(f"{path}.json", "w") as f:
+        json.dump(grid, f, indent=4)
+
+
+def load_distance_raster(path, index=None):
+    """
+    Load a distance raster saved by build_distance_raster, memory-mapped. The index, in a metric plane (see build_feature_index), is used for the points outside the grid
+    """
+    with open(f"{path}.json") as f:
+        raster = json.load(f)
+    raster["values"] = np.load(f"{path}.npy", mmap_mode="r")
+    raster["index"] = index
+    return raster
+
+
+def get_distance_raster(
+    features, raster_path="cache/rasters/", bbox=LONDON_BBOX, resolution=25, margin=2000
+):
+    """
+    Get the distance raster of features, built once and stored in raster_path by features fingerprint, bounding box and resolution.
+    The raster is built from the index in the longitude/latitude plane, the points outside it are answered by an unsimplified index in the metric plane
+    """
+    index = build_feature_index(features)
+    os.makedirs(raster_path, exist_ok=True)
+    name = f"{get_index_fingerprint(index)}_{'_'.join(map(str, bbox))}_{resolution}_{margin}"
+    path = f"{raster_path}/{name}"
+    if not (os.path.exists(f"{path}.npy") and os.path.exists(f"{path}.json")):
+        build_distance_raster(index, path, bbox, resolution, margin)
+    return load_distance_raster(path, build_feature_index(features, 0))
+
+
+def lookup_distances(raster, latitudes, longitudes):
+    """
+    Get the distances of points by bilinear interpolation of the raster.
+    Inside the grid, the distance to the shapes differs by at most resolution * sqrt(2) meters (half a cell diagonal to rasterize, half a cell diagonal to interpolate),
+    plus about 0.5% of the distance from the single longitude scale.
+    Points outside the grid, or whose distance is larger than their distance to the edge of the grid (a feature outside the grid could be nearer),
+    are computed with the metric index of the raster, within about 1% of the geodesic distance over London (NaN without index).
+    Both differ from the default index method, which measures to the nearest point in the longitude/latitude plane and overestimates by up to 60% in London
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    values = raster["values"]
+    rows, cols = get_grid_positions(raster, latitudes, longitudes)
+    edge_distances = raster["resolution"] * np.minimum(
+        np.minimum(rows, values.shape[0] - 1 - rows),
+        np.minimum(cols, values.shape[1] - 1 - cols),
+    )
+    inside = edge_distances >= 0
+    row = np.minimum(np.floor(rows[inside]).astype(int), values.shape[0] - 2)
+    col = np.minimum(np.floor(cols[inside]).astype(int), values.shape[1] - 2)
+    weight_row = rows[inside] - row
+    weight_col = cols[inside] - col
+
+    distances = np.full(len(latitudes), np.nan)
+    distances[inside] = (
+        values[row, col] * (1 - weight_row) * (1 - weight_col)
+        + values[row + 1, col] * weight_row * (1 - weight_col)
+        + values[row, col + 1] * (1 - weight_row) * weight_col
+        + values[row + 1, col + 1] * weight_row * weight_col
+    )
+    exact = ~inside & np.isfinite(latitudes) & np.isfinite(longitudes)
+    exact[inside] = distances[inside] > edge_distances[inside] - raster[
+        "resolution"
+    ] * np.sqrt(2)
+    if raster["index"] is not None and exact.any():
+        distances[exact] = query_nearest_distances(
+            raster["index"], latitudes[exact], longitudes[exact]
+        )
+    return distances
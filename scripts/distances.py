@@ -8,20 +8,43 @@
 #                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
 #                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
 #                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
-#      Update: 2022/05/31 18:39:02 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#      Update: 2026/10/18 09:44:23 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
 #                                                                                                                           #
 # ************************************************************************************************************************* #
 
 from OSMPythonTools.overpass import overpassQueryBuilder, Overpass
 from shapely.geometry import Point, Polygon, LineString
-from shapely.ops import nearest_points
 import matplotlib.pyplot as plt
-import haversine as hs
+from matplotlib.collections import LineCollection, PolyCollection
+import numpy as np
+import shapely
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 import math
 import time
 import pandas as pd
 
 from .utils import *
+from .distance_kernel import (
+    EARTH_RADIUS,
+    nearest_vertex_distances,
+    nearest_segment_distances,
+    rings_to_segments,
+    bbox_lower_bound_distances,
+)
+from .spatial_index import (
+    normalize_features,
+    get_boundary_segments,
+    build_feature_index,
+    query_nearest_distances,
+    get_index_fingerprint,
+    simplify_shapes,
+    get_projection_latitude,
+    project_coordinates,
+    project_shapes,
+)
+from .distance_cache import cached_distances, save_distance_cache
+from .distance_raster import get_distance_raster, lookup_distances
 
 
 def add_target(targets, column_name, featureType, selector, display_color="red"):
@@ -71,13 +94,22 @@ def load_OSM_data(targets, areaId=None, bbox=None):
     return targets
 
 
+def get_target_features(target):
+    """
+    Get the features of a target: the geometries loaded from the feature store, else the OSM elements
+    """
+    if "geometries" in target:
+        return target["geometries"]
+    return target["features"].elements()
+
+
 def print_number_of_features(targets):
     """
     Print the number of loaded OSM features for the targets
     """
     for key in targets:
         target = targets[key]
-        print(f"{key} {couleurs.KO}#{len(target['features'].elements())}{couleurs.FIN}")
+        print(f"{key} {couleurs.KO}#{len(get_target_features(target))}{couleurs.FIN}")
 
 
 def get_nearest_point_of_polygon(
@@ -90,10 +122,13 @@ def get_nearest_point_of_polygon(
         poly = Polygon([(a, b) for [a, b] in poly_shape])
     else:
         poly = LineString([(a, b) for [a, b] in poly_shape])
-    point = Point(loc[1], loc[0])
-    p1, _ = nearest_points(poly, point)
 
-    tmp = list(zip(*p1.coords.xy))[0]
+    if is_polygon and poly.covers(Point(loc[1], loc[0])):
+        tmp = (loc[1], loc[0])
+    else:
+        segments, _ = rings_to_segments([poly_shape])
+        _, _, nearest = nearest_segment_distances([loc], segments)
+        tmp = (float(nearest[0][1]), float(nearest[0][0]))
 
     if show_graph:
         plt.plot(*poly.exterior.xy, color="blue", label="Polygon")
@@ -106,80 +141,114 @@ def get_nearest_point_of_polygon(
             linestyle=":",
             label="Distance",
         )
-        plt.scatter(*p1.coords.xy, color="red", label="Nearest point from polygon")
+        plt.scatter(tmp[0], tmp[1], color="red", label="Nearest point from polygon")
         plt.scatter(x=loc[1], y=loc[0], color="green", label="Location reference")
         plt.legend(loc="upper right")
         plt.show()
     return (tmp[1], tmp[0])
 
 
+def get_nearest_shape(shapes, point):
+    """
+    Get the distance and the index of the nearest shape (Point, LineString or Polygon) from a point, with the vectorized distance kernel
+    """
+    types = shapely.get_type_id(shapes)
+    points_idx = np.flatnonzero(types == shapely.GeometryType.POINT)
+    polygons_idx = np.flatnonzero(types == shapely.GeometryType.POLYGON)
+
+    distance, nearest = nearest_vertex_distances(
+        [point], shapely.get_coordinates(shapes[points_idx])[:, ::-1]
+    )
+    minimal_distance = distance[0]
+    nearest_shape = points_idx[nearest[0]] if nearest[0] >= 0 else None
+
+    inside = shapely.contains_xy(shapes[polygons_idx], point[1], point[0])
+    if np.any(inside):
+        return 0.0, polygons_idx[np.argmax(inside)]
+
+    segments, owners = get_boundary_segments(shapes)
+    distance, nearest, _ = nearest_segment_distances([point], segments, owners)
+    if distance[0] < minimal_distance:
+        minimal_distance = distance[0]
+        nearest_shape = nearest[0]
+    return float(minimal_distance), nearest_shape
+
+
+def get_pixel_error(ax, shapes):
+    """
+    Get the size in meters of a pixel of the axes when the shapes fill its width, to simplify the shapes without visible change
+    """
+    minx, miny, maxx, maxy = shapely.total_bounds(shapes)
+    width = ax.get_window_extent().width
+    meters = np.radians(maxx - minx) * EARTH_RADIUS * np.cos(np.radians(maxy))
+    return meters / max(width, 1)
+
+
+def add_shapes_collections(ax, shapes, color, fillColor, label=None, rasterized=False):
+    """
+    Draw shapes (Point, LineString or Polygon) with one collection per geometry type instead of one artist per shape.
+    The polygons are filled (without their holes), the label is set once per type
+    """
+    types = shapely.get_type_id(shapes)
+    polygons = shapes[types == shapely.GeometryType.POLYGON]
+    lines = shapes[
+        (types == shapely.GeometryType.LINESTRING)
+        | (types == shapely.GeometryType.LINEARRING)
+    ]
+    points = shapes[types == shapely.GeometryType.POINT]
+
+    if len(polygons) > 0:
+        coordinates, idx = shapely.get_coordinates(
+            shapely.get_exterior_ring(polygons), return_index=True
+        )
+        vertices = np.split(coordinates, np.flatnonzero(np.diff(idx)) + 1)
+        ax.add_collection(
+            PolyCollection(
+                vertices,
+                facecolors=fillColor + "BB",
+                edgecolors=color,
+                label=label,
+                rasterized=rasterized,
+            )
+        )
+    if len(lines) > 0:
+        coordinates, idx = shapely.get_coordinates(lines, return_index=True)
+        vertices = np.split(coordinates, np.flatnonzero(np.diff(idx)) + 1)
+        ax.add_collection(
+            LineCollection(vertices, colors=color, label=label, rasterized=rasterized)
+        )
+    if len(points) > 0:
+        coordinates = shapely.get_coordinates(points)
+        ax.scatter(
+            coordinates[:, 0],
+            coordinates[:, 1],
+            color=color,
+            label=label,
+            rasterized=rasterized,
+        )
+    ax.autoscale_view()
+
+
 def get_nearest_feature_distance(
     features, point, show_graph=False, fillColor="#DD0000", feature_name=None
 ):
     """
     Get the distance of the nearest feature between an array of features and a point
     """
-    minimal_distance = math.inf
-    nearest_feature = None
-
-    for feature in features:
-        try:
-            feature_type = feature.geometry().type
-            if feature_type == "MultiPolygon":
-                local_min = math.inf
-                for poly_shape in feature.geometry().coordinates[0]:
-                    nearest_point = get_nearest_point_of_polygon(
-                        poly_shape, point, True
-                    )
-                    distance = hs.haversine(point, nearest_point, unit=hs.Unit.METERS)
-                    if distance < local_min:
-                        local_min = distance
-                distance = local_min
-            if feature_type in ["Polygon", "Polyline"]:
-                nearest_point = get_nearest_point_of_polygon(
-                    feature.geometry().coordinates[0], point, feature_type == "Polygon"
-                )
-                distance = hs.haversine(point, nearest_point, unit=hs.Unit.METERS)
-            elif feature_type == "Point":
-                distance = hs.haversine(
-                    point,
-                    (
-                        feature.geometry().coordinates[1],
-                        feature.geometry().coordinates[0],
-                    ),
-                    unit=hs.Unit.METERS,
-                )
-            if distance < minimal_distance:
-                minimal_distance = distance
-                nearest_feature = feature
-        except:
-            pass
+    normalized = normalize_features(features)
+    shapes = normalized["shapes"]
+    owners = normalized["owners"]
+    minimal_distance, nearest = get_nearest_shape(shapes, point)
 
     if show_graph:
-        for feature in features:
-            try:
-                color = "red" if feature == nearest_feature else fillColor
-                name = feature_name if feature_name else "feature"
-                label = f"Nearest {name}" if feature == nearest_feature else f"{name}"
-                feature_type = feature.geometry().type
-                if feature_type == "MultiPolygon":
-                    for poly_shape in feature.geometry().coordinates[0]:
-                        poly = Polygon([(a, b) for [a, b] in poly_shape])
-                        plt.plot(*poly.exterior.xy, color=color)
-                        plt.fill(*poly.exterior.xy, color=fillColor + "BB", label=label)
-                elif feature_type in ["Polygon", "Polyline"]:
-                    poly = Polygon(
-                        [(a, b) for [a, b] in feature.geometry().coordinates[0]]
-                    )
-                    plt.plot(*poly.exterior.xy, color=color, label=label)
-                    if feature_type == "Polygon":
-                        plt.fill(*poly.exterior.xy, color=fillColor + "BB")
-                elif feature_type == "Point":
-                    plt.scatter(
-                        *feature.geometry().coordinates, color=color, label=label
-                    )
-            except:
-                pass
+        name = feature_name if feature_name else "feature"
+        nearest_owner = owners[nearest] if nearest is not None else None
+        is_nearest = owners == nearest_owner
+        ax = plt.gca()
+        add_shapes_collections(ax, shapes[~is_nearest], fillColor, fillColor, name)
+        add_shapes_collections(
+            ax, shapes[is_nearest], "red", fillColor, f"Nearest {name}"
+        )
         plt.scatter(x=point[1], y=point[0], color="blue", label="Location reference")
         handles, labels = plt.gca().get_legend_handles_labels()
         by_label = dict(zip(labels, handles))
@@ -188,36 +257,50 @@ def get_nearest_feature_distance(
     return minimal_distance
 
 
-def plot_features(features, fillColor="#FF0000", key=None):
+def plot_features(
+    features, fillColor="#FF0000", key=None, max_error=None, rasterized=False, ax=None
+):
     """
-    Display the features
+    Display the features, all at once with collections.
+    With max_error (meters, or "auto" for the size of a pixel), the shapes are simplified before drawing. rasterized draws them as an image in vector outputs
     """
-    for feature in features:
-        try:
-            feature_type = feature.geometry().type
-            if feature_type == "MultiPolygon":
-                for poly_shape in feature.geometry().coordinates[0]:
-                    poly = Polygon([(a, b) for [a, b] in poly_shape])
-                    plt.fill(*poly.exterior.xy, color=fillColor + "BB", label=key)
-            elif feature_type in ["Polygon", "Polyline"]:
-                poly = Polygon([(a, b) for [a, b] in feature.geometry().coordinates[0]])
-                plt.plot(*poly.exterior.xy, color=fillColor + "BB", label=key)
-                if feature_type == "Polygon":
-                    plt.fill(*poly.exterior.xy, color=fillColor + "BB")
-            elif feature_type == "Point":
-                plt.scatter(*feature.geometry().coordinates, color=fillColor, label=key)
-        except:
-            pass
+    ax = ax or plt.gca()
+    normalized = normalize_features(features)
+    shapes = normalized["shapes"]
+    if max_error == "auto" and len(shapes) > 0:
+        max_error = get_pixel_error(ax, shapes)
+    if max_error:
+        shapes = simplify_shapes(shapes, max_error)
+    add_shapes_collections(ax, shapes, fillColor + "BB", fillColor, key, rasterized)
+    print_skipped_features(key, normalized)
 
 
-def plot_targets(targets):
+def print_skipped_features(key, normalized):
     """
-    Plot all the targets. Plot all fatures for each target
+    Print the number of features of a target skipped or repaired by normalize_features, if any
     """
+    if normalized["skipped"] > 0 or normalized["invalid"] > 0:
+        print(
+            f"{key} {couleurs.ATTENTION}{normalized['skipped']} features skipped, {normalized['invalid']} invalid features repaired{couleurs.FIN}"
+        )
+
+
+def plot_targets(targets, max_error=None, rasterized=False):
+    """
+    Plot all the targets. Plot all fatures for each target, see plot_features for max_error and rasterized
+    """
+    ax = plt.gca()
     for k in targets:
         target = targets[k]
-        plot_features(target["features"].elements(), target["display_color"], k)
-    handles, labels = plt.gca().get_legend_handles_labels()
+        plot_features(
+            get_target_features(target),
+            target["display_color"],
+            k,
+            max_error,
+            rasterized,
+            ax,
+        )
+    handles, labels = ax.get_legend_handles_labels()
     by_label = dict(zip(labels, handles))
     plt.legend(
         by_label.values(), by_label.keys(), loc="center left", bbox_to_anchor=(1, 0.5)
@@ -225,28 +308,296 @@ def plot_targets(targets):
     plt.show()
 
 
-def calculate_distances(data, targets, save_path="computed_distances/"):
+def prepare_feature_shapes(features, max_error=None):
     """
-    Calculate the nearest element distances for all points in a dataframe
+    Get once the shapes of the features used by get_nearest_feature_distance, and their bounding boxes.
+    With max_error (meters, 0 for no simplification), the shapes are simplified and projected in the metric plane of simplify_shapes, as build_feature_index does
     """
+    normalized = normalize_features(features)
+    shapes = normalized["shapes"]
+    latitude = None
+    if max_error is not None:
+        latitude = get_projection_latitude(shapes)
+        shapes = project_shapes(simplify_shapes(shapes, max_error, latitude), latitude)
+    return {
+        "latitude": latitude,
+        "shapes": shapes,
+        "owners": normalized["owners"],
+        "bounds": shapely.bounds(shapes).reshape(-1, 4),
+        "skipped": normalized["skipped"],
+        "invalid": normalized["invalid"],
+    }
+
+
+def get_nearest_pruned_distance(prepared, point):
+    """
+    Get the distance of the nearest shape prepared by prepare_feature_shapes from a point.
+    The shape with the nearest bounding box gives an upper bound, only the shapes whose bounding box lower bound is below it are compared
+    """
+    if len(prepared["shapes"]) == 0:
+        return math.inf
+    if prepared["latitude"] is None:
+        lower_bounds = bbox_lower_bound_distances(
+            point[0], point[1], prepared["bounds"]
+        )
+        distance = lambda shapes: get_nearest_shape(shapes, point)[0]
+    else:
+        x, y = project_coordinates(np.array([point[1], point[0]]), prepared["latitude"])
+        bounds = prepared["bounds"]
+        lower_bounds = np.hypot(
+            np.maximum(np.maximum(bounds[:, 0] - x, x - bounds[:, 2]), 0),
+            np.maximum(np.maximum(bounds[:, 1] - y, y - bounds[:, 3]), 0),
+        )
+        distance = lambda shapes: float(np.min(shapely.distance(shapes, Point(x, y))))
+    order = np.argsort(lower_bounds, kind="stable")
+    upper_bound = distance(prepared["shapes"][order[:1]])
+    candidates = np.sort(order[lower_bounds[order] <= upper_bound])
+    if len(candidates) <= 1:
+        return upper_bound
+    return distance(prepared["shapes"][candidates])
+
+
+def prepare_target(features, method="index", max_error=None, resolution=25):
+    """
+    Prepare the features of a target for the distances calculation with the given method.
+    With max_error (meters), the "index" and "pruned" methods simplify the shapes and measure the distances in a metric plane, "loop" stays exact.
+    This changes the distances themselves, not only by the simplification, see compare_with_exact.
+    "raster" loads (or builds once) the distance raster of the target over London with cells of resolution meters, see lookup_distances for its error bound
+    """
+    if method == "index":
+        return build_feature_index(features, max_error)
+    elif method == "pruned":
+        return prepare_feature_shapes(features, max_error)
+    elif method == "raster":
+        return get_distance_raster(features, resolution=resolution)
+    elif method == "loop":
+        return features
+    raise Exception(f"Unknown method {method} to calculate the distances")
+
+
+def calculate_chunk_distances(prepared, latitudes, longitudes, method="index"):
+    """
+    Calculate the nearest element distances of a prepared target for arrays of latitudes and longitudes
+    """
+    if method == "index":
+        return query_nearest_distances(prepared, latitudes, longitudes)
+    elif method == "raster":
+        return lookup_distances(prepared, latitudes, longitudes)
+    elif method == "pruned":
+        distance = get_nearest_pruned_distance
+    else:
+        distance = get_nearest_feature_distance
+    return np.array(
+        [
+            distance(prepared, (latitude, longitude))
+            for latitude, longitude in zip(latitudes, longitudes)
+        ],
+        dtype=float,
+    )
+
+
+def compare_with_exact(features, latitudes, longitudes, method="pruned", max_error=1.0):
+    """
+    Compare the distances of a method with shapes simplified within max_error meters against the ones of the unsimplified shapes (max_error=0), on a sample of points.
+    Both are measured in the same metric plane, where the maximum deviation is at most max_error.
+    Passing any max_error also changes the distance itself: the default (max_error=None) takes the nearest point in the longitude/latitude plane, which overestimates
+    the distance by up to a factor 1 / cos(latitude) (60% in London), while the metric plane stays within about 1% of the geodesic distance over London.
+    This change against the default output is reported as max_metric_change, it is not bounded by max_error.
+    Returns the times, the speedup, the maximum deviation and the maximum metric change in meters
+    """
+    default = calculate_chunk_distances(
+        prepare_target(features, method, None), latitudes, longitudes, method
+    )
+    start_time = time.time()
+    exact = calculate_chunk_distances(
+        prepare_target(features, method, 0), latitudes, longitudes, method
+    )
+    exact_seconds = time.time() - start_time
+    start_time = time.time()
+    approximate = calculate_chunk_distances(
+        prepare_target(features, method, max_error), latitudes, longitudes, method
+    )
+    seconds = time.time() - start_time
+    report = {
+        "method": method,
+        "max_error": max_error,
+        "exact_seconds": exact_seconds,
+        "seconds": seconds,
+        "speedup": exact_seconds / seconds,
+        "max_deviation": float(np.nanmax(np.abs(approximate - exact))),
+        "max_metric_change": float(np.nanmax(np.abs(approximate - default))),
+    }
+    print(
+        f"{method} with max error {max_error} m : {couleurs.OKVERT}x{round(report['speedup'], 1)}{couleurs.FIN} faster, max deviation {couleurs.ATTENTION}{round(report['max_deviation'], 3)} m{couleurs.FIN}, "
+        f"max change from the default distances {couleurs.ATTENTION}{round(report['max_metric_change'], 1)} m{couleurs.FIN}"
+    )
+    return report
+
+
+def save_target_distances(data, key, distances, save_path, start_time, details=""):
+    """
+    Save the nearest element distances of a target and print the time it took
+    """
+    distances_data = pd.DataFrame({f"nearest_{key}": distances}, index=data.index)
+    distances_data.to_csv(f"{save_path}/{key}_data.csv")
+    print(
+        f"--> {key} took {couleurs.OKVERT} {(time.time() - start_time)} seconds{couleurs.FIN}{details}"
+    )
+
+
+# State of calculate_distances shared with the worker processes, inherited read-only when they are forked
+workers_state = {}
+
+
+def calculate_worker_chunk(key, start, stop):
+    """
+    Calculate the nearest element distances of a target for the rows [start, stop[, in a worker process.
+    Returns the distances and the seconds it took
+    """
+    start_time = time.time()
+    distances = calculate_chunk_distances(
+        workers_state["prepared"][key],
+        workers_state["latitudes"][start:stop],
+        workers_state["longitudes"][start:stop],
+        workers_state["method"],
+    )
+    return distances, time.time() - start_time
+
+
+def calculate_distances_parallel(
+    data,
+    targets,
+    save_path,
+    method,
+    workers,
+    chunk_size,
+    max_error=None,
+    resolution=25,
+):
+    """
+    Calculate the nearest element distances with a pool of processes, split by target and by chunks of rows.
+    The time printed for each target is the time to prepare it plus the time of its chunks in the workers
+    """
+    workers_state["method"] = method
+    workers_state["latitudes"] = data["latitude"].to_numpy(dtype=float)
+    workers_state["longitudes"] = data["longitude"].to_numpy(dtype=float)
+    workers_state["prepared"] = {}
+    seconds = {}
     for key in targets:
         print(
-            f"{key} {couleurs.KO}#{len(targets[key]['features'].elements())}{couleurs.FIN}"
+            f"{key} {couleurs.KO}#{len(get_target_features(targets[key]))}{couleurs.FIN}"
         )
-        obj = targets[key]["features"].elements()
         start_time = time.time()
-        column_name = f"nearest_{key}"
-        distances_data = pd.DataFrame(
-            {
-                column_name: data[["latitude", "longitude"]].apply(
-                    lambda x: get_nearest_feature_distance(
-                        obj, (x.latitude, x.longitude)
-                    ),
-                    axis=1,
-                )
+        workers_state["prepared"][key] = prepare_target(
+            get_target_features(targets[key]), method, max_error, resolution
+        )
+        if method == "raster":
+            print_skipped_features(key, workers_state["prepared"][key]["index"])
+        elif method != "loop":
+            print_skipped_features(key, workers_state["prepared"][key])
+        seconds[key] = time.time() - start_time
+
+    starts = range(0, max(len(data), 1), chunk_size)
+    results = {key: {} for key in targets}
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            futures = {
+                executor.submit(
+                    calculate_worker_chunk, key, start, start + chunk_size
+                ): (key, start)
+                for key in targets
+                for start in starts
             }
+            for future in as_completed(futures):
+                key, start = futures[future]
+                results[key][start], chunk_seconds = future.result()
+                seconds[key] += chunk_seconds
+                if len(results[key]) == len(starts):
+                    distances = np.concatenate([results[key][s] for s in starts])
+                    save_target_distances(
+                        data, key, distances, save_path, time.time() - seconds[key]
+                    )
+    finally:
+        workers_state.clear()
+
+
+def get_cache_target_id(key, features, prepared, method, max_error=None):
+    """
+    Get the id of a target in the distance cache: its key, the method and the fingerprint of its shapes, and the grid of the raster for "raster",
+    so that the distances of another method, feature set or raster are never served from the cache
+    """
+    if method == "raster":
+        grid = "_".join(map(str, prepared["bbox"]))
+        return f"{key}-raster-{prepared['fingerprint']}-{grid}-{prepared['resolution']}-{prepared['margin']}"
+    index = (
+        prepared
+        if method == "index"
+        else build_feature_index(features, max_error if method == "pruned" else None)
+    )
+    return f"{key}-{method}-{get_index_fingerprint(index)}"
+
+
+def calculate_distances(
+    data,
+    targets,
+    save_path="computed_distances/",
+    method="index",
+    workers=1,
+    chunk_size=1024,
+    cache=None,
+    max_error=None,
+    resolution=25,
+):
+    """
+    Calculate the nearest element distances for all points in a dataframe.
+    method="index" answers all the points at once with a spatial index, method="loop" calls get_nearest_feature_distance for each row.
+    With workers > 1, the targets and chunks of chunk_size rows are shared between a pool of forked processes.
+    A cache created by create_distance_cache computes only once each location, or grid cell with its resolution (sequential mode only).
+    method="pruned" skips the shapes by bounding box, and max_error simplifies the shapes within this number of meters.
+    Any max_error, even 0, measures the distances in a metric plane instead of the longitude/latitude plane, which changes them beyond max_error (see compare_with_exact).
+    method="raster" interpolates precomputed distance rasters with cells of resolution meters
+    """
+    if (
+        workers > 1
+        and cache is None
+        and "fork" in multiprocessing.get_all_start_methods()
+    ):
+        calculate_distances_parallel(
+            data, targets, save_path, method, workers, chunk_size, max_error, resolution
         )
-        distances_data.to_csv(f"{save_path}/{key}_data.csv")
+        return
+
+    for key in targets:
         print(
-            f"--> {key} took {couleurs.OKVERT} {(time.time() - start_time)} seconds{couleurs.FIN}"
+            f"{key} {couleurs.KO}#{len(get_target_features(targets[key]))}{couleurs.FIN}"
+        )
+        start_time = time.time()
+        features = get_target_features(targets[key])
+        prepared = prepare_target(features, method, max_error, resolution)
+        if method == "raster":
+            print_skipped_features(key, prepared["index"])
+        elif method != "loop":
+            print_skipped_features(key, prepared)
+        if cache is None:
+            distances = calculate_chunk_distances(
+                prepared, data["latitude"], data["longitude"], method
+            )
+            save_target_distances(data, key, distances, save_path, start_time)
+            continue
+
+        distances, hits, misses = cached_distances(
+            cache,
+            get_cache_target_id(key, features, prepared, method, max_error),
+            data["latitude"],
+            data["longitude"],
+            lambda latitudes, longitudes: calculate_chunk_distances(
+                prepared, latitudes, longitudes, method
+            ),
         )
+        details = f" cache {couleurs.OKCYAN}{hits} hits{couleurs.FIN} {couleurs.ATTENTION}{misses} misses{couleurs.FIN}"
+        save_target_distances(data, key, distances, save_path, start_time, details)
+
+    if cache is not None:
+        save_distance_cache(cache)
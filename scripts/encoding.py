@@ -0,0 +1,150 @@
+# ************************************************************************************************************************* #
+#   UTC Header                                                                                                              #
+#                                                         ::::::::::::::::::::       :::    ::: :::::::::::  ::::::::       #
+#      encoding.py                                        ::::::::::::::::::::       :+:    :+:     :+:     :+:    :+:      #
+#                                                         ::::::::::::::+++#####+++  +:+    +:+     +:+     +:+             #
+#      By: Branly, Tran Quoc <->                          ::+++##############+++     +:+    +:+     +:+     +:+             #
+#      https://github.com/StephaneBranly              +++##############+++::::       +#+    +:+     +#+     +#+             #
+#                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
+#      Update: 2026/10/18 08:43:15 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#                                                                                                                           #
+# ************************************************************************************************************************* #
+
+from scipy import sparse
+import pandas as pd
+import numpy as np
+import pickle
+
+
+def fit_encoder(X, cols, y=None):
+    """
+    Fit the encoding of the categorical columns cols of X, and of the target y if given.
+    The categories are numbered from 1 in their order of appearance, missing values last (as category_encoders does), the target classes are sorted (as LabelEncoder does)
+    """
+    encoder = {
+        "columns": list(X.columns),
+        "cols": list(cols),
+        "categories": {},
+        "classes": None,
+    }
+    for col in cols:
+        values = X[col].astype(object)
+        categories = list(values.dropna().unique())
+        if values.isnull().any():
+            categories.append(np.nan)
+        encoder["categories"][col] = pd.Index(categories, dtype=object)
+    if y is not None:
+        encoder["classes"] = np.unique(np.asarray(y))
+    return encoder
+
+
+def get_code_dtype(n_codes):
+    """
+    Get the smallest signed integer type able to store the codes -2 to n_codes
+    """
+    return np.result_type(np.int8, np.min_scalar_type(n_codes))
+
+
+def get_ordinal_codes(encoder, X, col):
+    """
+    Get the codes of the values of a column. Unknown values are coded -1 and unknown missing values -2
+    """
+    categories = encoder["categories"][col]
+    values = X[col].astype(object)
+    codes = categories.get_indexer(values) + 1
+    codes[codes == 0] = -1
+    codes[(codes == -1) & values.isnull().to_numpy()] = -2
+    return codes.astype(get_code_dtype(len(categories)))
+
+
+def get_feature_names(encoder, onehot=False):
+    """
+    Get the names of the columns of the encoded matrix
+    """
+    if not onehot:
+        return list(encoder["columns"])
+    names = []
+    for col in encoder["columns"]:
+        if col in encoder["categories"]:
+            names += [f"{col}_{i + 1}" for i in range(len(encoder["categories"][col]))]
+        else:
+            names.append(col)
+    return names
+
+
+def transform_ordinal(encoder, X):
+    """
+    Encode the categorical columns of X with compact integer codes, the other columns are kept
+    """
+    X_oe = X[encoder["columns"]].copy()
+    for col in encoder["cols"]:
+        X_oe[col] = get_ordinal_codes(encoder, X, col)
+    return X_oe
+
+
+def transform_onehot(encoder, X, as_sparse=True):
+    """
+    Encode the categorical columns of X with one column per category, the other columns are kept.
+    Returns a CSR matrix, or a dense dataframe if as_sparse is False. Unknown values have no category set
+    """
+    blocks = []
+    for col in encoder["columns"]:
+        if col in encoder["categories"]:
+            codes = get_ordinal_codes(encoder, X, col)
+            rows = np.flatnonzero(codes > 0)
+            blocks.append(
+                sparse.csr_matrix(
+                    (np.ones(len(rows)), (rows, codes[rows] - 1)),
+                    shape=(len(X), len(encoder["categories"][col])),
+                )
+            )
+        else:
+            blocks.append(sparse.csr_matrix(X[[col]].to_numpy(dtype=float)))
+    matrix = sparse.hstack(blocks, format="csr")
+    if as_sparse:
+        return matrix
+    return pd.DataFrame(
+        matrix.toarray(), index=X.index, columns=get_feature_names(encoder, True)
+    )
+
+
+def encode_targets(encoder, y):
+    """
+    Encode the target classes with compact integer codes
+    """
+    classes = encoder["classes"]
+    y = np.asarray(y)
+    codes = np.searchsorted(classes, y)
+    unknown = (codes >= len(classes)) | (
+        classes[np.minimum(codes, len(classes) - 1)] != y
+    )
+    if unknown.any():
+        raise ValueError(
+            f"y contains previously unseen labels: {np.unique(y[unknown])}"
+        )
+    return codes.astype(get_code_dtype(len(classes)))
+
+
+def decode_targets(encoder, codes):
+    """
+    Get the target classes of integer codes
+    """
+    return encoder["classes"][np.asarray(codes)]
+
+
+def save_encoder(encoder, path):
+    """
+    Save a fitted encoder, to transform new data without fitting it again
+    """
+    with open(path, "wb") as f:
+        pickle.dump(encoder, f)
+
+
+def load_encoder(path):
+    """
+    Load an encoder saved by save_encoder
+    """
+    with open(path, "rb") as f:
+        return pickle.load(f)
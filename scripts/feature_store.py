@@ -0,0 +1,119 @@
+# ************************************************************************************************************************* #
+#   UTC Header                                                                                                              #
+#                                                         ::::::::::::::::::::       :::    ::: :::::::::::  ::::::::       #
+#      feature_store.py                                   ::::::::::::::::::::       :+:    :+:     :+:     :+:    :+:      #
+#                                                         ::::::::::::::+++#####+++  +:+    +:+     +:+     +:+             #
+#      By: Branly, Tran Quoc <->                          ::+++##############+++     +:+    +:+     +:+     +:+             #
+#      https://github.com/StephaneBranly              +++##############+++::::       +#+    +:+     +#+     +#+             #
+#                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
+#      Update: 2026/10/18 09:45:12 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#                                                                                                                           #
+# ************************************************************************************************************************* #
+
+from shapely.geometry import shape
+import numpy as np
+import shapely
+import hashlib
+import json
+import os
+
+from .utils import *
+from .distances import load_OSM_data
+
+
+def get_target_store_key(target, areaId=None, bbox=None):
+    """
+    Get the key of a target in the feature store, from its selector, feature type and area
+    """
+    description = json.dumps(
+        {
+            "areaId": areaId,
+            "bbox": bbox,
+            "featureType": target["featureType"],
+            "selector": target["selector"],
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+
+def features_to_geometries(features, key=""):
+    """
+    Build the shapely geometries of OSM elements. Elements whose geometry cannot be built are skipped,
+    and their number by element type is printed. Returns the geometries, the OSM ids and the number of skipped elements
+    """
+    geometries = []
+    ids = []
+    skipped = {}
+    for feature in features:
+        try:
+            geometries.append(shape(feature.geometry()))
+            ids.append(feature.id())
+        except Exception:
+            skipped[feature.type()] = skipped.get(feature.type(), 0) + 1
+    for element_type, count in skipped.items():
+        print(
+            f"{key} {couleurs.ATTENTION}{count} {element_type} features without geometry skipped{couleurs.FIN}"
+        )
+    return (
+        np.array(geometries, dtype=object),
+        np.array(ids, dtype=np.int64),
+        sum(skipped.values()),
+    )
+
+
+def save_target_geometries(path, geometries, ids, skipped=0):
+    """
+    Save geometries in the feature store as one WKB buffer with the offsets, bounding boxes and OSM ids of the features
+    """
+    wkb = shapely.to_wkb(geometries)
+    offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in wkb])
+    np.savez(
+        path,
+        wkb=np.frombuffer(b"".join(wkb), dtype=np.uint8),
+        offsets=offsets,
+        bounds=shapely.bounds(geometries).reshape(-1, 4),
+        ids=ids,
+        skipped=skipped,
+    )
+
+
+def load_target_geometries(path):
+    """
+    Load the geometries of a target saved in the feature store
+    """
+    with np.load(path) as store:
+        buffer = store["wkb"].tobytes()
+        offsets = store["offsets"]
+        wkb = np.array(
+            [buffer[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)],
+            dtype=object,
+        )
+        return {
+            "geometries": shapely.from_wkb(wkb),
+            "bounds": store["bounds"],
+            "osm_ids": store["ids"],
+            "skipped_features": int(store["skipped"]),
+        }
+
+
+def load_OSM_features(targets, areaId=None, bbox=None, store_path="cache/features/"):
+    """
+    Load the geometries of the features of all the targets from the feature store.
+    Targets missing in the store are loaded with load_OSM_data (from the Overpass cache if present) and saved in the store
+    """
+    os.makedirs(store_path, exist_ok=True)
+    for key in targets:
+        target = targets[key]
+        path = f"{store_path}/{get_target_store_key(target, areaId, bbox)}.npz"
+        if not os.path.exists(path):
+            load_OSM_data({key: target}, areaId=areaId, bbox=bbox)
+            geometries, ids, skipped = features_to_geometries(
+                target["features"].elements(), key
+            )
+            save_target_geometries(path, geometries, ids, skipped)
+        target.update(load_target_geometries(path))
+    return targets
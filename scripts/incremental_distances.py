@@ -0,0 +1,102 @@
+# ************************************************************************************************************************* #
+#   UTC Header                                                                                                              #
+#                                                         ::::::::::::::::::::       :::    ::: :::::::::::  ::::::::       #
+#      incremental_distances.py                           ::::::::::::::::::::       :+:    :+:     :+:     :+:    :+:      #
+#                                                         ::::::::::::::+++#####+++  +:+    +:+     +:+     +:+             #
+#      By: Branly, Tran Quoc <->                          ::+++##############+++     +:+    +:+     +:+     +:+             #
+#      https://github.com/StephaneBranly              +++##############+++::::       +#+    +:+     +#+     +#+             #
+#                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
+#      Update: 2026/10/18 08:36:00 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#                                                                                                                           #
+# ************************************************************************************************************************* #
+
+import pandas as pd
+import numpy as np
+import json
+import os
+import time
+
+from .utils import *
+from .distances import get_target_features, save_target_distances
+from .spatial_index import (
+    build_feature_index,
+    query_nearest_distances,
+    get_index_fingerprint,
+)
+
+
+def get_incident_ids(data):
+    """
+    Get a stable identifier of each incident: its incident_number if known, else a hash of its date and location
+    """
+    ids = "h" + pd.util.hash_pandas_object(
+        data[["date_time_of_call", "latitude", "longitude"]], index=False
+    ).astype(str)
+    if "incident_number" in data.columns:
+        numbers = data["incident_number"]
+        ids = ids.where(numbers.isnull(), numbers.astype("Int64").astype(str))
+    return ids
+
+
+def load_distances_store(save_path):
+    """
+    Load the nearest element distances stored by incident identifier, and the fingerprints of the targets used to compute them
+    """
+    store = pd.DataFrame(index=pd.Index([], dtype=object, name="incident_id"))
+    manifest = {}
+    if os.path.exists(f"{save_path}/distances_store.feather"):
+        store = pd.read_feather(f"{save_path}/distances_store.feather")
+        store = store.set_index("incident_id")
+    if os.path.exists(f"{save_path}/distances_manifest.json"):
+        with open(f"{save_path}/distances_manifest.json") as f:
+            manifest = json.load(f)
+    return store, manifest
+
+
+def save_distances_store(save_path, store, manifest):
+    """
+    Save the nearest element distances stored by incident identifier, and the fingerprints of the targets
+    """
+    store.rename_axis("incident_id").reset_index().to_feather(
+        f"{save_path}/distances_store.feather"
+    )
+    with open(f"{save_path}/distances_manifest.json", "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+
+
+def calculate_distances_incremental(data, targets, save_path="computed_distances/"):
+    """
+    Calculate the nearest element distances only for the incidents without stored value, and for all the incidents of the targets whose features changed.
+    The results are merged in the store of save_path and the csv of each target is written for the rows of data
+    """
+    os.makedirs(save_path, exist_ok=True)
+    store, manifest = load_distances_store(save_path)
+    ids = get_incident_ids(data)
+    unique_ids = ~ids.duplicated().to_numpy()
+    store = store.reindex(store.index.union(pd.Index(ids[unique_ids])))
+
+    for key in targets:
+        start_time = time.time()
+        column_name = f"nearest_{key}"
+        index = build_feature_index(get_target_features(targets[key]))
+        fingerprint = get_index_fingerprint(index)
+
+        if column_name not in store.columns or manifest.get(key) != fingerprint:
+            store[column_name] = np.nan
+        missing = store.loc[ids[unique_ids], column_name].isnull().to_numpy()
+        rows = data[unique_ids][missing]
+        print(
+            f"{key} {couleurs.KO}#{len(get_target_features(targets[key]))}{couleurs.FIN} {couleurs.OKBLEU}{len(rows)} new rows{couleurs.FIN}"
+        )
+        store.loc[ids[unique_ids][missing], column_name] = query_nearest_distances(
+            index, rows["latitude"], rows["longitude"]
+        )
+        manifest[key] = fingerprint
+
+        distances = store.loc[ids, column_name].to_numpy()
+        save_target_distances(data, key, distances, save_path, start_time)
+
+    save_distances_store(save_path, store, manifest)
+    return store.loc[ids].set_index(data.index)
@@ -0,0 +1,169 @@
+# ************************************************************************************************************************* #
+#   UTC Header                                                                                                              #
+#                                                         ::::::::::::::::::::       :::    ::: :::::::::::  ::::::::       #
+#      pipeline.py                                        ::::::::::::::::::::       :+:    :+:     :+:     :+:    :+:      #
+#                                                         ::::::::::::::+++#####+++  +:+    +:+     +:+     +:+             #
+#      By: Branly, Tran Quoc <->                          ::+++##############+++     +:+    +:+     +:+     +:+             #
+#      https://github.com/StephaneBranly              +++##############+++::::       +#+    +:+     +#+     +#+             #
+#                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
+#      Update: 2026/10/18 09:43:58 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#                                                                                                                           #
+# ************************************************************************************************************************* #
+
+import pandas as pd
+import hashlib
+import inspect
+import json
+import os
+import time
+import tracemalloc
+
+from .utils import *
+from .clean_data import (
+    convert_to_latlon,
+    lower_case_animal_type,
+    convert_to_datetime_format,
+    remove_incoherent_values,
+    remove_duplicate_values,
+    remove_unused_columns,
+    add_columns_for_date,
+)
+
+
+def add_stage(pipeline, name, function, **params):
+    """
+    Add a stage in the pipeline. The function takes the dataframe and the params, and returns the dataframe
+    """
+    pipeline["stages"].append({"name": name, "function": function, "params": params})
+    return pipeline
+
+
+def create_cleaning_pipeline(cache_path="cache/pipeline/"):
+    """
+    Create the pipeline with all the cleaning stages of the raw animal rescues data, in order
+    """
+    pipeline = {"stages": [], "cache_path": cache_path}
+    add_stage(pipeline, "convert_to_latlon", convert_to_latlon)
+    add_stage(pipeline, "lower_case_animal_type", lower_case_animal_type)
+    add_stage(pipeline, "convert_to_datetime_format", convert_to_datetime_format)
+    add_stage(
+        pipeline, "remove_incoherent_values", remove_incoherent_values, inplace=True
+    )
+    add_stage(
+        pipeline, "remove_duplicate_values", remove_duplicate_values, inplace=True
+    )
+    add_stage(pipeline, "remove_unused_columns", remove_unused_columns)
+    add_stage(pipeline, "add_columns_for_date", add_columns_for_date)
+    return pipeline
+
+
+def get_file_hash(path):
+    """
+    Get the sha1 hash of a file content
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def get_stage_source(function):
+    """
+    Get the code a stage depends on: the source of the module of its function, and of the modules of the same package it uses
+    (so that editing a helper like get_transformer, month_dic or delete_feature invalidates the cache)
+    """
+    module = inspect.getmodule(function)
+    if module is None:
+        return function.__qualname__
+    package = module.__name__.rpartition(".")[0]
+    modules = {module.__name__: module}
+    for value in vars(module).values():
+        dependency = value if inspect.ismodule(value) else inspect.getmodule(value)
+        if dependency is not None and dependency.__name__.startswith(f"{package}."):
+            modules[dependency.__name__] = dependency
+    sources = []
+    for name in sorted(modules):
+        try:
+            sources.append(inspect.getsource(modules[name]))
+        except (OSError, TypeError):
+            sources.append(name)
+    return "\n".join(sources)
+
+
+def get_stages_keys(pipeline, file_hash, read_csv_kwargs=None):
+    """
+    Get the cache key of each stage output, from the input file hash, the arguments used to read it,
+    and the name, params and code (see get_stage_source) of the stage and the previous ones
+    """
+    keys = []
+    h = hashlib.sha1(file_hash.encode("utf-8"))
+    h.update(
+        json.dumps(read_csv_kwargs or {}, sort_keys=True, default=str).encode("utf-8")
+    )
+    for stage in pipeline["stages"]:
+        h.update(stage["name"].encode("utf-8"))
+        h.update(
+            json.dumps(stage["params"], sort_keys=True, default=str).encode("utf-8")
+        )
+        h.update(stage["function"].__qualname__.encode("utf-8"))
+        h.update(get_stage_source(stage["function"]).encode("utf-8"))
+        keys.append(h.copy().hexdigest())
+    return keys
+
+
+def run_pipeline(pipeline, path, use_cache=True, read_csv_kwargs=None):
+    """
+    Run the stages of the pipeline on the csv file, and return the dataframe and a report with the wall time and peak memory of each stage.
+    The output of each stage is cached, the run resumes from the last stage already cached for this file, read_csv_kwargs and these stages
+    """
+    cache_path = pipeline["cache_path"]
+    keys = get_stages_keys(pipeline, get_file_hash(path), read_csv_kwargs)
+    report = []
+
+    first_stage = 0
+    data = None
+    if use_cache:
+        for i in reversed(range(len(keys))):
+            if os.path.exists(f"{cache_path}/{keys[i]}.pkl"):
+                data = pd.read_pickle(f"{cache_path}/{keys[i]}.pkl")
+                first_stage = i + 1
+                break
+    for stage in pipeline["stages"][:first_stage]:
+        report.append(
+            {
+                "stage": stage["name"],
+                "seconds": 0.0,
+                "peak_memory_mb": 0.0,
+                "cached": True,
+            }
+        )
+    if data is None:
+        data = pd.read_csv(path, **(read_csv_kwargs or {}))
+
+    if use_cache:
+        os.makedirs(cache_path, exist_ok=True)
+    for stage, key in zip(pipeline["stages"][first_stage:], keys[first_stage:]):
+        tracemalloc.start()
+        start_time = time.time()
+        data = stage["function"](data, **stage["params"])
+        seconds = time.time() - start_time
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"--> {stage['name']} took {couleurs.OKVERT} {seconds} seconds{couleurs.FIN}, peak memory {couleurs.ATTENTION}{round(peak / 2**20, 1)} MB{couleurs.FIN}"
+        )
+        report.append(
+            {
+                "stage": stage["name"],
+                "seconds": seconds,
+                "peak_memory_mb": peak / 2**20,
+                "cached": False,
+            }
+        )
+        if use_cache:
+            data.to_pickle(f"{cache_path}/{key}.pkl")
+
+    return data, pd.DataFrame(report)
@@ -0,0 +1,312 @@
+# ************************************************************************************************************************* #
+#   UTC Header                                                                                                              #
+#                                                         ::::::::::::::::::::       :::    ::: :::::::::::  ::::::::       #
+#      prediction.py                                      ::::::::::::::::::::       :+:    :+:     :+:     :+:    :+:      #
+#                                                         ::::::::::::::+++#####+++  +:+    +:+     +:+     +:+             #
+#      By: Branly, Tran Quoc <->                          ::+++##############+++     +:+    +:+     +:+     +:+             #
+#      https://github.com/StephaneBranly              +++##############+++::::       +#+    +:+     +#+     +#+             #
+#                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
+#      Update: 2026/10/18 09:45:12 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#                                                                                                                           #
+# ************************************************************************************************************************* #
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import Future
+import pandas as pd
+import numpy as np
+import argparse
+import pickle
+import queue
+import json
+import sys
+import threading
+import time
+
+from .utils import *
+from .clean_data import (
+    convert_to_latlon,
+    convert_to_datetime_format,
+    remove_unused_columns,
+    add_columns_for_date,
+)
+from .distances import get_target_features
+from .encoding import transform_ordinal, transform_onehot, decode_targets
+from .feature_store import features_to_geometries
+from .spatial_index import build_feature_index, query_nearest_distances
+from .storage import DISTANCE_PREFIX
+
+
+def create_predictor(model, encoder, targets=None, onehot=False):
+    """
+    Create a predictor from a fitted model, the encoder used to train it (see encoding.fit_encoder) and the targets of its nearest element distance features.
+    The model is trained on the encoded targets if the encoder has classes
+    """
+    geometries = {}
+    for key in targets or {}:
+        features = get_target_features(targets[key])
+        if "geometries" not in targets[key]:
+            features, _, _ = features_to_geometries(features, key)
+        geometries[key] = np.asarray(features, dtype=object)
+    predictor = {
+        "model": model,
+        "encoder": encoder,
+        "onehot": onehot,
+        "geometries": geometries,
+    }
+    return build_predictor_indexes(predictor)
+
+
+def build_predictor_indexes(predictor):
+    """
+    Build the spatial index of each target of the predictor
+    """
+    predictor["indexes"] = {
+        key: build_feature_index(geometries)
+        for key, geometries in predictor["geometries"].items()
+    }
+    return predictor
+
+
+def save_predictor(predictor, path):
+    """
+    Save the model, the encoder and the target geometries of a predictor. The spatial indexes are rebuilt when loaded
+    """
+    with open(path, "wb") as f:
+        pickle.dump({k: v for k, v in predictor.items() if k != "indexes"}, f)
+
+
+def load_predictor(path):
+    """
+    Load a predictor saved by save_predictor
+    """
+    with open(path, "rb") as f:
+        return build_predictor_indexes(pickle.load(f))
+
+
+def prepare_batch(predictor, rows):
+    """
+    Apply the cleaning transforms and add the nearest element distances to raw rows (columns of the raw csv), and encode them as the model inputs.
+    The rows are not filtered, so that each one gets a prediction
+    """
+    data = pd.DataFrame(rows).reset_index(drop=True)
+    for column in ["latitude", "longitude", "easting_rounded", "northing_rounded"]:
+        if column in data:
+            data[column] = pd.to_numeric(data[column], errors="coerce")
+    data = convert_to_latlon(data)
+    data = convert_to_datetime_format(data)
+    data = remove_unused_columns(data)
+    data = add_columns_for_date(data)
+    for key, index in predictor["indexes"].items():
+        data[f"{DISTANCE_PREFIX}{key}"] = query_nearest_distances(
+            index, data["latitude"], data["longitude"]
+        )
+
+    encoder = predictor["encoder"]
+    for column in encoder["columns"]:
+        if column not in encoder["cols"] and (
+            pd.api.types.is_string_dtype(data[column])
+            or pd.api.types.is_object_dtype(data[column])
+        ):
+            data[column] = pd.to_numeric(data[column], errors="coerce")
+    if predictor["onehot"]:
+        return transform_onehot(encoder, data)
+    return transform_ordinal(encoder, data).to_numpy()
+
+
+def predict_prepared(predictor, X):
+    """
+    Predict the animal_group_parent of rows prepared by prepare_batch
+    """
+    predictions = predictor["model"].predict(X)
+    if predictor["encoder"]["classes"] is not None:
+        predictions = decode_targets(predictor["encoder"], predictions)
+    return predictions
+
+
+def predict_batch(predictor, rows):
+    """
+    Predict the animal_group_parent of a batch of raw rows
+    """
+    return predict_prepared(predictor, prepare_batch(predictor, rows))
+
+
+def predict_row(predictor, row, future):
+    """
+    Predict a single raw row into its future. A row that cannot be prepared sets a ValueError (bad input), a failing model its own exception
+    """
+    try:
+        X = prepare_batch(predictor, [row])
+    except Exception as e:
+        future.set_exception(ValueError(f"Invalid row: {e}"))
+        return
+    try:
+        future.set_result(predict_prepared(predictor, X)[0])
+    except Exception as e:
+        future.set_exception(e)
+
+
+def create_micro_batcher(predictor, batch_size=1000, max_delay=0.01):
+    """
+    Start a thread predicting the rows submitted one by one with submit_row, grouped in batches of at most batch_size rows.
+    A batch is predicted when it is full or max_delay seconds after its first row.
+    If the batch fails, its rows are predicted one by one so that a malformed row only fails its own future
+    """
+    batcher = {"queue": queue.Queue(), "batch_size": batch_size}
+
+    def run():
+        while True:
+            items = [batcher["queue"].get()]
+            if items[0] is None:
+                return
+            deadline = time.time() + max_delay
+            while len(items) < batch_size:
+                try:
+                    item = batcher["queue"].get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    batcher["queue"].put(None)
+                    break
+                items.append(item)
+            try:
+                predictions = predict_batch(predictor, [row for row, _ in items])
+            except Exception:
+                for row, future in items:
+                    predict_row(predictor, row, future)
+                continue
+            for (_, future), prediction in zip(items, predictions):
+                future.set_result(prediction)
+
+    batcher["thread"] = threading.Thread(target=run, daemon=True)
+    batcher["thread"].start()
+    return batcher
+
+
+def submit_row(batcher, row):
+    """
+    Submit a raw row (dict) to the micro batcher, returns a future of its prediction.
+    Rows that are not dicts are rejected with a ValueError before joining a batch
+    """
+    future = Future()
+    if not isinstance(row, dict):
+        future.set_exception(ValueError(f"A row must be a JSON object, not {row!r}"))
+    else:
+        batcher["queue"].put((row, future))
+    return future
+
+
+def stop_micro_batcher(batcher):
+    """
+    Predict the rows already submitted and stop the thread of the micro batcher
+    """
+    batcher["queue"].put(None)
+    batcher["thread"].join()
+
+
+def serve_stdin(predictor, batch_size=1000, max_delay=0.01, input=None, output=None):
+    """
+    Read raw rows as JSON lines and write their predictions as JSON lines, in the same order.
+    A row that cannot be predicted gets an {"error": ...} line
+    """
+    input = input or sys.stdin
+    output = output or sys.stdout
+    batcher = create_micro_batcher(predictor, batch_size, max_delay)
+    futures = queue.Queue()
+
+    def write():
+        while True:
+            future = futures.get()
+            if future is None:
+                return
+            try:
+                answer = {"animal_group_parent": str(future.result())}
+            except Exception as e:
+                answer = {"error": str(e)}
+            output.write(json.dumps(answer) + "\n")
+            if futures.empty():
+                output.flush()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    for line in input:
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                failed = Future()
+                failed.set_exception(ValueError(f"Invalid JSON: {e}"))
+                futures.put(failed)
+                continue
+            futures.put(submit_row(batcher, row))
+    futures.put(None)
+    writer.join()
+    output.flush()
+    stop_micro_batcher(batcher)
+
+
+def serve_http(predictor, port=8000, batch_size=1000, max_delay=0.01):
+    """
+    Serve the predictions on localhost: POST /predict with a JSON list of raw rows returns the list of their animal_group_parent.
+    The rows of concurrent requests are predicted together by the micro batcher. Bad input is answered with 400, other failures with 500
+    """
+    batcher = create_micro_batcher(predictor, batch_size, max_delay)
+
+    class PredictionHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/predict":
+                self.send_error(404)
+                return
+            try:
+                rows = json.loads(
+                    self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                )
+                if not isinstance(rows, list):
+                    raise ValueError("The body must be a JSON list of rows")
+                futures = [submit_row(batcher, row) for row in rows]
+                body = json.dumps([str(f.result()) for f in futures]).encode("utf-8")
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), PredictionHandler)
+    print(
+        f"Serving predictions on {couleurs.OKBLEU}http://127.0.0.1:{port}/predict{couleurs.FIN}"
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        stop_micro_batcher(batcher)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Predict the animal_group_parent of new incidents with a saved predictor"
+    )
+    parser.add_argument(
+        "predictor", help="path of the predictor saved by save_predictor"
+    )
+    parser.add_argument(
+        "--http", type=int, help="serve on this local port instead of stdin/stdout"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--max-delay", type=float, default=0.01)
+    args = parser.parse_args()
+    predictor = load_predictor(args.predictor)
+    if args.http:
+        serve_http(predictor, args.http, args.batch_size, args.max_delay)
+    else:
+        serve_stdin(predictor, args.batch_size, args.max_delay)
@@ -0,0 +1,66 @@
+# ************************************************************************************************************************* #
+#   UTC Header                                                                                                              #
+#                                                         ::::::::::::::::::::       :::    ::: :::::::::::  ::::::::       #
+#      spatial_features.py                                ::::::::::::::::::::       :+:    :+:     :+:     :+:    :+:      #
+#                                                         ::::::::::::::+++#####+++  +:+    +:+     +:+     +:+             #
+#      By: Branly, Tran Quoc <->                          ::+++##############+++     +:+    +:+     +:+     +:+             #
+#      https://github.com/StephaneBranly              +++##############+++::::       +#+    +:+     +#+     +#+             #
+#                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
+#      Update: 2026/10/18 09:04:32 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#                                                                                                                           #
+# ************************************************************************************************************************* #
+
+import pandas as pd
+import time
+import os
+
+from .utils import *
+from .distances import get_target_features, print_skipped_features
+from .spatial_index import (
+    build_feature_index,
+    query_k_nearest_distances,
+    query_radius_features,
+)
+
+
+def get_spatial_features(index, latitudes, longitudes, key, k=3, radii=(500,)):
+    """
+    Get the spatial features of the points for a target: the distances of its k nearest features (nearest1_key, ...),
+    and for each radius (meters) the number of features and the area of polygons within the radius (count500_key, area500_key)
+    """
+    columns = {}
+    k_distances = query_k_nearest_distances(index, latitudes, longitudes, k)
+    for i in range(k):
+        columns[f"nearest{i + 1}_{key}"] = k_distances[:, i]
+    for radius in radii:
+        counts, areas = query_radius_features(index, latitudes, longitudes, radius)
+        columns[f"count{radius}_{key}"] = counts
+        columns[f"area{radius}_{key}"] = areas
+    return columns
+
+
+def calculate_spatial_features(
+    data, targets, k=3, radii=(500,), save_path="computed_distances/"
+):
+    """
+    Calculate the spatial features of each row of data for each target (see get_spatial_features),
+    saved as csv next to the nearest element distances, so that load_computed_distances loads them too
+    """
+    os.makedirs(save_path, exist_ok=True)
+    for key in targets:
+        features = get_target_features(targets[key])
+        print(f"{key} {couleurs.KO}#{len(features)}{couleurs.FIN}")
+        start_time = time.time()
+        index = build_feature_index(features)
+        print_skipped_features(key, index)
+        columns = get_spatial_features(
+            index, data["latitude"], data["longitude"], key, k, radii
+        )
+        pd.DataFrame(columns, index=data.index).to_csv(
+            f"{save_path}/{key}_spatial_data.csv"
+        )
+        print(
+            f"--> {key} took {couleurs.OKVERT} {(time.time() - start_time)} seconds{couleurs.FIN}"
+        )
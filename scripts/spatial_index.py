@@ -0,0 +1,465 @@
+# ************************************************************************************************************************* #
+#   UTC Header                                                                                                              #
+#                                                         ::::::::::::::::::::       :::    ::: :::::::::::  ::::::::       #
+#      spatial_index.py                                   ::::::::::::::::::::       :+:    :+:     :+:     :+:    :+:      #
+#                                                         ::::::::::::::+++#####+++  +:+    +:+     +:+     +:+             #
+#      By: Branly, Tran Quoc <->                          ::+++##############+++     +:+    +:+     +:+     +:+             #
+#      https://github.com/StephaneBranly              +++##############+++::::       +#+    +:+     +#+     +#+             #
+#                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
+#      Update: 2026/10/18 09:42:11 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#                                                                                                                           #
+# ************************************************************************************************************************* #
+
+from shapely.geometry import shape
+from shapely.geometry.base import BaseGeometry
+from shapely.strtree import STRtree
+import hashlib
+import numpy as np
+import shapely
+import math
+
+from .distance_kernel import EARTH_RADIUS, haversine_distances, nearest_vertex_distances
+
+
+def get_feature_shape(feature):
+    """
+    Get the shapely geometry of a feature, either an OSM element or a shapely geometry of the feature store
+    """
+    if isinstance(feature, BaseGeometry):
+        return feature
+    return shape(feature.geometry())
+
+
+def normalize_features(features):
+    """
+    Convert the features (OSM elements or shapely geometries) to a flat array of Point, LineString and Polygon (holes included) shapes, with the index of the feature of each shape.
+    All the polygons of a MultiPolygon and all the lines of a MultiLineString are kept. Invalid geometries are repaired with make_valid.
+    Returns the shapes, their owners, the number of features skipped because their geometry cannot be built or is empty, and the number of invalid features repaired
+    """
+    geometries = np.empty(len(features), dtype=object)
+    for i, feature in enumerate(features):
+        try:
+            geometries[i] = get_feature_shape(feature)
+        except Exception:
+            geometries[i] = None
+    missing = shapely.is_missing(geometries)
+    skipped = int(np.sum(missing | shapely.is_empty(geometries)))
+    invalid = ~missing & ~shapely.is_valid(geometries)
+    geometries[invalid] = shapely.make_valid(geometries[invalid])
+
+    shapes, owners = shapely.get_parts(geometries, return_index=True)
+    while np.any(shapely.get_type_id(shapes) >= shapely.GeometryType.MULTIPOINT):
+        shapes, parts_owners = shapely.get_parts(shapes, return_index=True)
+        owners = owners[parts_owners]
+    not_empty = ~shapely.is_empty(shapes)
+    return {
+        "shapes": shapes[not_empty],
+        "owners": owners[not_empty],
+        "skipped": skipped,
+        "invalid": int(np.sum(invalid)),
+    }
+
+
+def get_boundary_segments(shapes):
+    """
+    Get the (K,4) array of segments (lat1, lon1, lat2, lon2) of the LineString shapes and of the rings (exterior and holes) of the Polygon shapes,
+    and the index of the shape of each segment. The segments of a shape are contiguous
+    """
+    types = shapely.get_type_id(shapes)
+    is_polygon = types == shapely.GeometryType.POLYGON
+    rings, rings_owners = shapely.get_rings(shapes[is_polygon], return_index=True)
+    lines_owners = np.flatnonzero(~is_polygon & (types != shapely.GeometryType.POINT))
+    boundaries = np.concatenate([rings, shapes[lines_owners]])
+    owners = np.concatenate([np.flatnonzero(is_polygon)[rings_owners], lines_owners])
+    order = np.argsort(owners, kind="stable")
+    boundaries = boundaries[order]
+    owners = owners[order]
+
+    coordinates, boundary_idx = shapely.get_coordinates(boundaries, return_index=True)
+    same = boundary_idx[1:] == boundary_idx[:-1]
+    segments = np.hstack(
+        [coordinates[:-1][same][:, ::-1], coordinates[1:][same][:, ::-1]]
+    )
+    return segments.reshape(-1, 4), owners[boundary_idx[:-1][same]]
+
+
+def get_projection_latitude(shapes):
+    """
+    Get the latitude of the plane of project_shapes for the shapes: the middle of their bounding box
+    """
+    _, miny, _, maxy = shapely.total_bounds(shapes)
+    return float((miny + maxy) / 2) if np.isfinite(miny) else 0.0
+
+
+def project_coordinates(coordinates, latitude, inverse=False):
+    """
+    Project (longitude, latitude) coordinates to meters on the plane tangent at latitude (equirectangular: longitudes scaled by cos(latitude)), or back with inverse
+    """
+    scale = np.radians(1) * EARTH_RADIUS * np.array([np.cos(np.radians(latitude)), 1])
+    return coordinates / scale if inverse else coordinates * scale
+
+
+def project_shapes(shapes, latitude, inverse=False):
+    """
+    Project the shapes in the metric plane of project_coordinates, or back to longitude/latitude with inverse
+    """
+    return shapely.transform(
+        shapes, lambda coordinates: project_coordinates(coordinates, latitude, inverse)
+    )
+
+
+def simplify_lines(lines, max_error):
+    """
+    Simplify LineString or LinearRing shapes with Douglas-Peucker so that every point moves by at most max_error.
+    Each line is simplified as two open halves, as GEOS may drop the end point of closed lines beyond the tolerance. Returns the coordinates and the index of the line of each coordinate
+    """
+    coordinates, line_idx = shapely.get_coordinates(lines, return_index=True)
+    starts = np.searchsorted(line_idx, np.arange(len(lines)))
+    sizes = np.diff(np.append(starts, len(line_idx)))
+    positions = np.arange(len(line_idx)) - starts[line_idx]
+    middles = sizes[line_idx] // 2
+    first = positions <= middles
+    second = positions >= middles
+    half_idx = np.concatenate([2 * line_idx[first], 2 * line_idx[second] + 1])
+    order = np.argsort(half_idx, kind="stable")
+    halves = shapely.linestrings(
+        np.concatenate([coordinates[first], coordinates[second]])[order],
+        indices=half_idx[order],
+    )
+
+    coordinates, half_idx = shapely.get_coordinates(
+        shapely.simplify(halves, max_error, preserve_topology=False), return_index=True
+    )
+    # The middle point ends the first half and starts the second one
+    second_start = (half_idx % 2 == 1) & np.append(True, half_idx[1:] != half_idx[:-1])
+    return coordinates[~second_start], half_idx[~second_start] // 2
+
+
+def simplify_shapes(shapes, max_error, latitude=None):
+    """
+    Simplify the boundaries of the shapes (Douglas-Peucker in the metric plane of project_shapes at latitude, the middle of the shapes by default) so that they move by at most max_error meters.
+    Rings that would collapse are kept as they are. Distances measured in the same plane (see build_feature_index) move by at most max_error too
+    """
+    if latitude is None:
+        latitude = get_projection_latitude(shapes)
+    simplified = shapes.copy()
+    types = shapely.get_type_id(shapes)
+    is_line = types == shapely.GeometryType.LINESTRING
+    is_polygon = types == shapely.GeometryType.POLYGON
+
+    lines = project_shapes(shapes[is_line], latitude)
+    coordinates, line_idx = simplify_lines(lines, max_error)
+    simplified[is_line] = project_shapes(
+        shapely.linestrings(coordinates, indices=line_idx), latitude, inverse=True
+    )
+
+    rings, polygon_idx = shapely.get_rings(shapes[is_polygon], return_index=True)
+    rings = project_shapes(rings, latitude)
+    coordinates, ring_idx = simplify_lines(rings, max_error)
+    collapsed = np.bincount(ring_idx, minlength=len(rings)) < 4
+    simplified_rings = rings.copy()
+    kept = ~collapsed[ring_idx]
+    simplified_rings[~collapsed] = shapely.linearrings(
+        coordinates[kept], indices=np.unique(ring_idx[kept], return_inverse=True)[1]
+    )
+    simplified[is_polygon] = project_shapes(
+        shapely.polygons(simplified_rings, indices=polygon_idx), latitude, inverse=True
+    )
+    return simplified
+
+
+def build_feature_index(features, max_error=None):
+    """
+    Build a spatial index (STRtree) over the shapes of the features, to answer nearest distance queries for batches of points.
+    Point features are kept apart as a vertices array, handled by the vectorized distance kernel.
+    With max_error (meters, 0 for no simplification), the shapes are simplified by simplify_shapes and all the distances are measured in its metric plane,
+    so that they differ by at most max_error from the ones of the unsimplified shapes in that plane.
+    They are not the distances of the default index (max_error=None), which measures to the nearest point in the longitude/latitude plane
+    """
+    normalized = normalize_features(features)
+    shapes = normalized["shapes"]
+    owners = normalized["owners"]
+    is_point = shapely.get_type_id(shapes) == shapely.GeometryType.POINT
+    latitude = None
+    if max_error is not None:
+        latitude = get_projection_latitude(shapes)
+        shapes = project_shapes(simplify_shapes(shapes, max_error, latitude), latitude)
+        is_point[:] = False
+    geometries = shapes[~is_point]
+    shapely.prepare(geometries)
+    return {
+        "latitude": latitude,
+        "geometries": geometries,
+        "owners": owners[~is_point],
+        "tree": STRtree(geometries),
+        "vertices": shapely.get_coordinates(shapes[is_point])[:, ::-1],
+        "vertex_owners": owners[is_point],
+        "vertex_tree": STRtree(shapes[is_point]),
+        "skipped": normalized["skipped"],
+        "invalid": normalized["invalid"],
+    }
+
+
+def nearest_shape_distances(geometries, points, latitudes, longitudes):
+    """
+    Get the haversine distance between each point and the nearest point of the paired geometry (lon/lat plane projection)
+    """
+    lines = shapely.shortest_line(geometries, points)
+    nearest = shapely.get_coordinates(lines)[::2]
+    return haversine_distances(latitudes, longitudes, nearest[:, 1], nearest[:, 0])
+
+
+def get_index_points(index, latitudes, longitudes):
+    """
+    Get the shapely points of (latitude, longitude) arrays, in the metric plane of the index if it has one
+    """
+    if index["latitude"] is None:
+        return shapely.points(longitudes, latitudes)
+    coordinates = np.column_stack([longitudes, latitudes])
+    return shapely.points(project_coordinates(coordinates, index["latitude"]))
+
+
+def get_index_distances(index, geometries, points, latitudes, longitudes):
+    """
+    Get the distances in meters between the points of get_index_points and their paired geometry of the index
+    """
+    if index["latitude"] is None:
+        return nearest_shape_distances(geometries, points, latitudes, longitudes)
+    return shapely.distance(geometries, points)
+
+
+def get_index_radius(index, latitudes, radius):
+    """
+    Get the radius of a query of the tree of the index containing every shape within radius meters
+    """
+    if index["latitude"] is None:
+        return get_degrees_radius(latitudes, radius)
+    return radius
+
+
+def query_nearest_distances(index, latitudes, longitudes, batch_size=2048):
+    """
+    Get the distance in meters of the nearest feature of the index for each (latitude, longitude) point
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    distances, _ = nearest_vertex_distances(
+        np.column_stack([latitudes, longitudes]), index["vertices"]
+    )
+    if len(index["geometries"]) == 0:
+        return distances
+
+    geometries = index["geometries"]
+    tree = index["tree"]
+    for start in range(0, len(latitudes), batch_size):
+        lat = latitudes[start : start + batch_size]
+        lon = longitudes[start : start + batch_size]
+        points = get_index_points(index, lat, lon)
+
+        # The nearest shape in the lon/lat plane gives an upper bound of the haversine distance (the distance itself in a metric plane)
+        point_idx, shape_idx = tree.query_nearest(points, all_matches=False)
+        upper_bound = np.full(len(lat), math.inf)
+        upper_bound[point_idx] = get_index_distances(
+            index,
+            geometries[shape_idx],
+            points[point_idx],
+            lat[point_idx],
+            lon[point_idx],
+        )
+        if index["latitude"] is not None:
+            distances[start : start + batch_size] = upper_bound
+            continue
+
+        # Every shape closer than this bound lies within a radius in degrees, widened by the longitude shrinking
+        radius = get_degrees_radius(lat, upper_bound)
+        valid = np.flatnonzero(np.isfinite(radius))
+        point_idx, shape_idx = tree.query(
+            points[valid], predicate="dwithin", distance=radius[valid]
+        )
+        point_idx = valid[point_idx]
+        candidates = nearest_shape_distances(
+            geometries[shape_idx], points[point_idx], lat[point_idx], lon[point_idx]
+        )
+        batch_distances = np.minimum(upper_bound, distances[start : start + batch_size])
+        np.minimum.at(batch_distances, point_idx, candidates)
+        distances[start : start + batch_size] = batch_distances
+    return distances
+
+
+def get_degrees_radius(latitudes, radius):
+    """
+    Get a radius in degrees containing every point within radius meters, widened by the longitude shrinking
+    """
+    max_latitude = np.minimum(
+        np.abs(latitudes) + np.degrees(radius / EARTH_RADIUS), 89.0
+    )
+    return np.degrees(radius / EARTH_RADIUS) / np.cos(np.radians(max_latitude)) * 1.01
+
+
+def query_within_distance(index, latitudes, longitudes, radius):
+    """
+    Get the pairs of points and shapes of the index whose distance (as computed by query_nearest_distances) is at most radius meters, a scalar or one radius per point.
+    Returns the indices of the points, the owners (feature indices) of the shapes, the distances, and the indices of the shapes in index["geometries"] (-1 for point features)
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    radius = np.broadcast_to(np.asarray(radius, dtype=float), latitudes.shape)
+    points = get_index_points(index, latitudes, longitudes)
+    degrees_radius = get_index_radius(index, latitudes, radius)
+
+    point_idx, shape_idx = index["tree"].query(
+        points, predicate="dwithin", distance=degrees_radius
+    )
+    distances = get_index_distances(
+        index,
+        index["geometries"][shape_idx],
+        points[point_idx],
+        latitudes[point_idx],
+        longitudes[point_idx],
+    )
+    vertex_point_idx, vertex_idx = index["vertex_tree"].query(
+        shapely.points(longitudes, latitudes),
+        predicate="dwithin",
+        distance=get_degrees_radius(latitudes, radius),
+    )
+    vertex_distances = haversine_distances(
+        latitudes[vertex_point_idx],
+        longitudes[vertex_point_idx],
+        index["vertices"][vertex_idx, 0],
+        index["vertices"][vertex_idx, 1],
+    )
+
+    point_idx = np.concatenate([point_idx, vertex_point_idx])
+    owners = np.concatenate(
+        [index["owners"][shape_idx], index["vertex_owners"][vertex_idx]]
+    )
+    distances = np.concatenate([distances, vertex_distances])
+    shape_idx = np.concatenate([shape_idx, np.full(len(vertex_idx), -1)])
+    within = distances <= radius[point_idx]
+    return point_idx[within], owners[within], distances[within], shape_idx[within]
+
+
+def get_feature_distances(point_idx, owners, distances):
+    """
+    Keep the smallest distance of each (point, feature) pair returned by query_within_distance, sorted by point then distance
+    """
+    order = np.lexsort((distances, owners, point_idx))
+    point_idx, owners, distances = point_idx[order], owners[order], distances[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (point_idx[1:] != point_idx[:-1]) | (owners[1:] != owners[:-1])
+    point_idx, owners, distances = point_idx[first], owners[first], distances[first]
+    order = np.lexsort((distances, point_idx))
+    return point_idx[order], owners[order], distances[order]
+
+
+def query_k_nearest_distances(
+    index, latitudes, longitudes, k=3, radius=500, max_radius=50000, batch_size=2048
+):
+    """
+    Get the (N,k) array of the distances in meters of the k nearest features of the index for each (latitude, longitude) point.
+    The features are searched within radius meters (at least twice the nearest distance), doubled for the points with less than k features found,
+    up to max_radius (NaN for the missing features). With k=1, the distances are the ones of query_nearest_distances
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    k_distances = np.full((len(latitudes), k), np.nan)
+    for start in range(0, len(latitudes), batch_size):
+        remaining = np.arange(start, min(start + batch_size, len(latitudes)))
+        nearest = query_nearest_distances(
+            index, latitudes[remaining], longitudes[remaining]
+        )
+        search_radius = np.minimum(np.maximum(radius, 2 * nearest), max_radius)
+        while len(remaining) > 0:
+            point_idx, owners, distances = get_feature_distances(
+                *query_within_distance(
+                    index, latitudes[remaining], longitudes[remaining], search_radius
+                )[:3]
+            )
+            starts = np.searchsorted(point_idx, np.arange(len(remaining)))
+            ranks = np.arange(len(point_idx)) - starts[point_idx]
+            found = np.bincount(point_idx, minlength=len(remaining))
+            done = (found >= k) | (search_radius >= max_radius)
+            kept = (ranks < k) & done[point_idx]
+            k_distances[remaining[point_idx[kept]], ranks[kept]] = distances[kept]
+            remaining = remaining[~done]
+            search_radius = np.minimum(search_radius[~done] * 2, max_radius)
+    return k_distances
+
+
+def get_local_shapes(geometries, latitudes, longitudes):
+    """
+    Project each geometry in meters on the plane tangent at its paired (latitude, longitude) point (equirectangular, exact enough for a few kilometers)
+    """
+    coordinates_owners = np.repeat(
+        np.arange(len(geometries)), shapely.get_num_coordinates(geometries)
+    )
+    scale = math.radians(1) * EARTH_RADIUS
+
+    def project(coordinates):
+        origin_latitudes = latitudes[coordinates_owners]
+        origin_longitudes = longitudes[coordinates_owners]
+        return np.column_stack(
+            [
+                (coordinates[:, 0] - origin_longitudes)
+                * np.cos(np.radians(origin_latitudes))
+                * scale,
+                (coordinates[:, 1] - origin_latitudes) * scale,
+            ]
+        )
+
+    return shapely.transform(geometries, project)
+
+
+def query_radius_features(index, latitudes, longitudes, radius, batch_size=2048):
+    """
+    Get for each (latitude, longitude) point the number of features of the index within radius meters,
+    and the area in square meters of the polygons of these features inside the disc of radius meters (summed, overlapping polygons are counted twice)
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    counts = np.zeros(len(latitudes), dtype=int)
+    areas = np.zeros(len(latitudes))
+    disc = shapely.buffer(shapely.Point(0, 0), radius, quad_segs=32)
+    for start in range(0, len(latitudes), batch_size):
+        lat = latitudes[start : start + batch_size]
+        lon = longitudes[start : start + batch_size]
+        point_idx, owners, distances, shape_idx = query_within_distance(
+            index, lat, lon, radius
+        )
+        point_idx_features, _, _ = get_feature_distances(point_idx, owners, distances)
+        counts[start : start + batch_size] = np.bincount(
+            point_idx_features, minlength=len(lat)
+        )
+
+        is_polygon = shape_idx >= 0
+        is_polygon[is_polygon] = (
+            shapely.get_type_id(index["geometries"][shape_idx[is_polygon]])
+            == shapely.GeometryType.POLYGON
+        )
+        point_idx = point_idx[is_polygon]
+        polygons = index["geometries"][shape_idx[is_polygon]]
+        if index["latitude"] is None:
+            polygons = get_local_shapes(polygons, lat[point_idx], lon[point_idx])
+            discs = disc
+        else:
+            points = get_index_points(index, lat[point_idx], lon[point_idx])
+            discs = shapely.buffer(points, radius, quad_segs=32)
+        areas[start : start + batch_size] = np.bincount(
+            point_idx,
+            weights=shapely.area(shapely.intersection(polygons, discs)),
+            minlength=len(lat),
+        )
+    return counts, areas
+
+
+def get_index_fingerprint(index):
+    """
+    Get a hash of the shapes of the index, changing when the feature set of the target changes
+    """
+    h = hashlib.sha1()
+    for wkb in shapely.to_wkb(index["geometries"]):
+        h.update(wkb)
+    h.update(np.ascontiguousarray(index["vertices"]).tobytes())
+    return h.hexdigest()
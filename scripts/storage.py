@@ -0,0 +1,77 @@
+# ************************************************************************************************************************* #
+#   UTC Header                                                                                                              #
+#                                                         ::::::::::::::::::::       :::    ::: :::::::::::  ::::::::       #
+#      storage.py                                         ::::::::::::::::::::       :+:    :+:     :+:     :+:    :+:      #
+#                                                         ::::::::::::::+++#####+++  +:+    +:+     +:+     +:+             #
+#      By: Branly, Tran Quoc <->                          ::+++##############+++     +:+    +:+     +:+     +:+             #
+#      https://github.com/StephaneBranly              +++##############+++::::       +#+    +:+     +#+     +#+             #
+#                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
+#                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
+#      Update: 2026/10/18 09:06:21 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#                                                                                                                           #
+# ************************************************************************************************************************* #
+
+import pyarrow.feather as feather
+import pandas as pd
+import glob
+import os
+
+DISTANCE_PREFIX = "nearest_"
+
+
+def load_computed_distances(path="computed_distances/"):
+    """
+    Load all the nearest element distances saved as csv by calculate_distances (and the spatial features of calculate_spatial_features), in one dataframe
+    """
+    distances = []
+    for file in sorted(glob.glob(f"{path}/*_data.csv")):
+        distances.append(pd.read_csv(file, index_col=0))
+    return pd.concat(distances, axis=1)
+
+
+def save_dataset(data, distances=None, path="data/dataset.feather"):
+    """
+    Save the cleaned dataframe and the nearest element distances columns in one columnar file, keeping the dtypes.
+    The format is chosen with the extension: .feather (uncompressed, can be memory-mapped) or .parquet
+    """
+    dataset = data if distances is None else data.join(distances)
+    dataset = dataset.rename_axis("index").reset_index()
+    if path.endswith(".parquet"):
+        dataset.to_parquet(path, index=False)
+    elif path.endswith(".feather"):
+        dataset.to_feather(path, compression="uncompressed")
+    else:
+        raise Exception(f"Unknown dataset format for {path}, use .feather or .parquet")
+    return path
+
+
+def load_dataset(path="data/dataset.feather", columns=None):
+    """
+    Load the dataset saved by save_dataset, only reading the given columns. Feather files are memory-mapped
+    """
+    if columns is not None:
+        columns = ["index"] + [c for c in columns if c != "index"]
+    if path.endswith(".parquet"):
+        dataset = pd.read_parquet(path, columns=columns)
+    elif path.endswith(".feather"):
+        dataset = feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+    else:
+        raise Exception(f"Unknown dataset format for {path}, use .feather or .parquet")
+    dataset = dataset.set_index("index")
+    dataset.index.name = None
+    return dataset
+
+
+def export_csv(
+    dataset, data_path="data/data.csv", distances_path="computed_distances/"
+):
+    """
+    Export a dataset as the csv files: the cleaned data and one file per nearest element distance column
+    """
+    distance_columns = [c for c in dataset.columns if c.startswith(DISTANCE_PREFIX)]
+    dataset.drop(columns=distance_columns).to_csv(data_path)
+    os.makedirs(distances_path, exist_ok=True)
+    for column in distance_columns:
+        key = column[len(DISTANCE_PREFIX) :]
+        dataset[[column]].to_csv(f"{distances_path}/{key}_data.csv")
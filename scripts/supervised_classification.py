@@ -8,18 +8,29 @@
 #                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
 #                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
 #                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
-#      Update: 2022/05/31 18:39:04 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#      Update: 2026/10/18 09:45:33 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
 #                                                                                                                           #
 # ************************************************************************************************************************* #
 
 from .utils import *
+from .encoding import (
+    fit_encoder,
+    transform_ordinal,
+    transform_onehot,
+    encode_targets,
+)
 
 import numpy as np
-import category_encoders as ce
-from sklearn.model_selection import RepeatedStratifiedKFold
-from sklearn import preprocessing
+import pandas as pd
+import hashlib
+import json
+import os
+import time
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+from sklearn.model_selection import RepeatedStratifiedKFold, ParameterGrid
 
-from sklearn.model_selection import cross_val_score
+from sklearn.base import clone
 
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.naive_bayes import GaussianNB
@@ -29,6 +40,9 @@ from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
 from sklearn.discriminant_analysis import QuadraticDiscriminantAnalysis
 from sklearn.ensemble import RandomForestClassifier
 
+# CPU budget shared by the folds, the estimators and the BLAS threads (None uses all the cores), and joblib backend of the folds
+execution_config = {"n_cpus": None, "backend": "loky"}
+
 
 def split_train_test(data, test_ratio):
     np.random.seed(42)
@@ -81,114 +95,324 @@ def prepare_inputs_oe(X, X_train, X_test, X_val, cols):
     """
         prepare input data
     this function takes the input data for the train and test sets and encodes
-    it using an ordinal enconding"""
-    oe = ce.OrdinalEncoder(cols=cols)
-    oe.fit(X)
-    X_train_oe = oe.transform(X_train)
-    X_test_oe = oe.transform(X_test)
-    X_val_oe = oe.transform(X_val)
+    it using an ordinal enconding. Use fit_encoder and transform_ordinal to reuse the encoder
+    """
+    encoder = fit_encoder(X, cols)
+    X_train_oe = transform_ordinal(encoder, X_train)
+    X_test_oe = transform_ordinal(encoder, X_test)
+    X_val_oe = transform_ordinal(encoder, X_val)
     return X_train_oe, X_val_oe, X_test_oe
 
 
-def prepare_inputs_ohe(X, X_train, X_test, X_val, cols):
-    oe = ce.OneHotEncoder(cols=cols)
-    oe.fit(X)
-    X_train_ohe = oe.transform(X_train)
-    X_val_ohe = oe.transform(X_val)
-    X_test_ohe = oe.transform(X_test)
+def prepare_inputs_ohe(X, X_train, X_test, X_val, cols, as_sparse=False):
+    """One hot encodes the input data, as CSR matrices if as_sparse is True. Use fit_encoder and transform_onehot to reuse the encoder"""
+    encoder = fit_encoder(X, cols)
+    X_train_ohe = transform_onehot(encoder, X_train, as_sparse)
+    X_val_ohe = transform_onehot(encoder, X_val, as_sparse)
+    X_test_ohe = transform_onehot(encoder, X_test, as_sparse)
     return X_train_ohe, X_val_ohe, X_test_ohe
 
 
 def prepare_targets(y, y_train, y_val, y_test):
     """The prepare_targets() integer encodes the output data for the train and test sets."""
-    le = preprocessing.LabelEncoder()
-    le.fit(y)
-    y_train_enc = le.transform(y_train)
-    y_val_enc = le.transform(y_val)
-    y_test_enc = le.transform(y_test)
+    encoder = fit_encoder(pd.DataFrame(), [], y)
+    y_train_enc = encode_targets(encoder, y_train)
+    y_val_enc = encode_targets(encoder, y_val)
+    y_test_enc = encode_targets(encoder, y_test)
     return y_train_enc, y_val_enc, y_test_enc
 
 
+def get_model(model="", hyperparam=1):
+    """
+    Get the estimator used by cross_validation for a model name
+    """
+    if model == "LDA":
+        return LinearDiscriminantAnalysis()
+    elif model == "QDA":
+        return QuadraticDiscriminantAnalysis()
+    elif model == "NB":
+        return GaussianNB()
+    elif model == "KNN":
+        return KNeighborsClassifier(n_neighbors=hyperparam)
+    elif model == "RF":
+        return RandomForestClassifier(
+            n_estimators=1400,
+            max_depth=80,
+            max_features="sqrt",
+            min_samples_leaf=1,
+            min_samples_split=5,
+            bootstrap=False,
+        )
+    elif model == "Mutiple_Logistic_reg":
+        return LogisticRegression(solver="lbfgs")
+    elif model == "Decision_tree":
+        return DecisionTreeClassifier(criterion="entropy")
+    raise Exception(f"Unknown model {model}")
+
+
 def KNN_cross_validation_accuracy(X_train, y_train, cv, hyperparam):
-    model = KNeighborsClassifier(n_neighbors=hyperparam)
+    model = get_model("KNN", hyperparam)
     # evaluate model
-    scores = cross_val_score(
-        model, X_train, y_train, scoring="accuracy", cv=cv, n_jobs=-1
-    )
+    scores = cross_validation_scores(model, X_train, y_train, cv)
     return scores
 
 
 def NB_cross_validation_accuracy(X_train, y_train, cv):
-    model = GaussianNB()
+    model = get_model("NB")
     # evaluate model
-    scores = cross_val_score(
-        model, X_train, y_train, scoring="accuracy", cv=cv, n_jobs=-1
-    )
+    scores = cross_validation_scores(model, X_train, y_train, cv)
     return scores
 
 
 def Mutiple_Logistic_reg_cross_validation_accuracy(X_train, y_train, cv):
-    model = LogisticRegression(multi_class="multinomial", solver="lbfgs")
+    model = get_model("Mutiple_Logistic_reg")
     # evaluate model
-    scores = cross_val_score(
-        model, X_train, y_train, scoring="accuracy", cv=cv, n_jobs=-1
-    )
+    scores = cross_validation_scores(model, X_train, y_train, cv)
     return scores
 
 
 def Decision_tree_cross_validation_accuracy(X_train, y_train, cv):
-    tree_model = DecisionTreeClassifier(criterion="entropy")
+    tree_model = get_model("Decision_tree")
     # evaluate model
-    scores = cross_val_score(
-        tree_model, X_train, y_train, scoring="accuracy", cv=cv, n_jobs=-1
-    )
+    scores = cross_validation_scores(tree_model, X_train, y_train, cv)
 
     return scores
 
 
 def LDA_cross_validation_accuracy(X_train, y_train, cv):
-    model = LinearDiscriminantAnalysis()
+    model = get_model("LDA")
     # evaluate model
-    scores = cross_val_score(
-        model,
-        X_train,
-        y_train,
-        scoring="accuracy",
-        cv=cv,
-        n_jobs=-1,
-        error_score="raise",
-    )
+    scores = cross_validation_scores(model, X_train, y_train, cv)
     return scores
 
 
 def QDA_cross_validation_accuracy(X_train, y_train, cv):
-    model = QuadraticDiscriminantAnalysis()
+    model = get_model("QDA")
     # evaluate model
-    scores = cross_val_score(
-        model,
-        X_train,
-        y_train,
-        scoring="accuracy",
-        cv=cv,
-        n_jobs=-1,
-        error_score="raise",
-    )
+    scores = cross_validation_scores(model, X_train, y_train, cv)
     return scores
 
 
 def RF_cross_validation_accuracy(X_train, y_train, cv):
-    best_model_RF = RandomForestClassifier(
-        n_estimators=1400,
-        max_depth=80,
-        max_features="sqrt",
-        min_samples_leaf=1,
-        min_samples_split=5,
-        bootstrap=False,
-        n_jobs=-1,
-    )
+    best_model_RF = get_model("RF")
     # evaluate model
-    scores = cross_val_score(
-        best_model_RF, X_train, y_train, scoring="accuracy", cv=cv, n_jobs=-1
-    )
+    scores = cross_validation_scores(best_model_RF, X_train, y_train, cv)
 
     return scores
+
+
+def get_fold_indices(y_train, folds=5, n_repeats=3, random_state=1):
+    """
+    Materialize the train and test indices of the repeated stratified k-fold splits, to share them between models
+    """
+    cv = RepeatedStratifiedKFold(
+        n_splits=folds, n_repeats=n_repeats, random_state=random_state
+    )
+    return list(cv.split(np.zeros(len(y_train)), y_train))
+
+
+def get_data_hash(*arrays):
+    """
+    Get a hash of the content of arrays or dataframes
+    """
+    h = hashlib.sha1()
+    for array in arrays:
+        if isinstance(array, (pd.DataFrame, pd.Series)):
+            h.update(pd.util.hash_pandas_object(array).to_numpy().tobytes())
+        elif np.asarray(array).dtype == object:
+            h.update(
+                pd.util.hash_array(np.asarray(array).ravel().astype(str)).tobytes()
+            )
+        else:
+            h.update(np.ascontiguousarray(array).tobytes())
+    return h.hexdigest()
+
+
+def get_model_key(estimator, data_hash):
+    """
+    Get the cache key of the fold results of an estimator, from its class and params and the data hash (folds included)
+    """
+    params = json.dumps(estimator.get_params(), sort_keys=True, default=str)
+    description = f"{type(estimator).__name__}{params}{data_hash}"
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+
+def set_execution_config(n_cpus=None, backend="loky"):
+    """
+    Set the CPU budget and the joblib backend ("loky", "multiprocessing" or "threading") used to evaluate the models
+    """
+    execution_config["n_cpus"] = n_cpus
+    execution_config["backend"] = backend
+    return execution_config
+
+
+def get_parallelism(estimator, n_folds):
+    """
+    Split the CPU budget between the folds evaluated in parallel, the jobs of the estimator and the BLAS threads of each fold.
+    Returns (fold_jobs, estimator_jobs, blas_threads), their product never exceeds the budget
+    """
+    n_cpus = execution_config["n_cpus"] or os.cpu_count()
+    fold_jobs = max(1, min(n_folds, n_cpus))
+    fold_cpus = max(1, n_cpus // fold_jobs)
+    estimator_jobs = fold_cpus if "n_jobs" in estimator.get_params() else 1
+    blas_threads = max(1, fold_cpus // estimator_jobs)
+    return fold_jobs, estimator_jobs, blas_threads
+
+
+def evaluate_fold(estimator, X, y, train_index, test_index, blas_threads=None):
+    """
+    Fit the estimator on the train indices and return its accuracy on the test indices, with the fit and predict times and the CPU time of the process
+    """
+    start_cpu = time.process_time()
+    with threadpool_limits(limits=blas_threads):
+        start_time = time.time()
+        estimator.fit(X[train_index], y[train_index])
+        fit_time = time.time() - start_time
+        start_time = time.time()
+        y_pred = estimator.predict(X[test_index])
+        predict_time = time.time() - start_time
+    return {
+        "accuracy": float(np.mean(y_pred == y[test_index])),
+        "fit_time": fit_time,
+        "predict_time": predict_time,
+        "cpu_time": time.process_time() - start_cpu,
+    }
+
+
+def evaluate_folds(estimator, X, y, fold_indices):
+    """
+    Evaluate the estimator on all the folds within the CPU budget, and print the CPU utilization achieved.
+    The utilization is the CPU time of the folds over the wall time of the budget, it is only meaningful with the process based backends
+    """
+    fold_jobs, estimator_jobs, blas_threads = get_parallelism(
+        estimator, len(fold_indices)
+    )
+    if "n_jobs" in estimator.get_params():
+        estimator = clone(estimator).set_params(n_jobs=estimator_jobs)
+    start_time = time.time()
+    results = Parallel(n_jobs=fold_jobs, backend=execution_config["backend"])(
+        delayed(evaluate_fold)(clone(estimator), X, y, train, test, blas_threads)
+        for train, test in fold_indices
+    )
+    wall_time = time.time() - start_time
+    budget = fold_jobs * estimator_jobs * blas_threads
+    utilization = sum(r["cpu_time"] for r in results) / (wall_time * budget)
+    print(
+        f"{type(estimator).__name__} : {fold_jobs} folds x {estimator_jobs} jobs x {blas_threads} BLAS threads, CPU utilization {couleurs.OKVERT}{round(100 * utilization)}%{couleurs.FIN} in {round(wall_time, 1)} seconds"
+    )
+    return results
+
+
+def cross_validation_scores(model, X_train, y_train, cv):
+    """
+    Get the accuracy of the model on each split of cv, evaluated within the CPU budget
+    """
+    X = np.asarray(X_train)
+    y = np.asarray(y_train)
+    results = evaluate_folds(model, X, y, list(cv.split(X, y)))
+    return np.array([r["accuracy"] for r in results])
+
+
+def benchmark_models(
+    X_train, y_train, models, folds=5, n_repeats=3, cache_path="cache/cv/"
+):
+    """
+    Evaluate the models (dict of name: estimator) against the same repeated stratified k-fold splits.
+    The folds are evaluated within the CPU budget of execution_config and the results are cached by estimator params and data hash. Returns a table with one row per model and fold
+    """
+    X = np.asarray(X_train)
+    y = np.asarray(y_train)
+    fold_indices = get_fold_indices(y, folds, n_repeats)
+    data_hash = get_data_hash(X, y, *[test for _, test in fold_indices])
+    if cache_path:
+        os.makedirs(cache_path, exist_ok=True)
+
+    scores = []
+    for name, estimator in models.items():
+        path = f"{cache_path}/{get_model_key(estimator, data_hash)}.json"
+        cached = bool(cache_path) and os.path.exists(path)
+        if cached:
+            with open(path) as f:
+                results = json.load(f)
+        else:
+            results = evaluate_folds(estimator, X, y, fold_indices)
+            if cache_path:
+                with open(path, "w") as f:
+                    json.dump(results, f)
+        for fold, result in enumerate(results):
+            scores.append({"model": name, "fold": fold, **result, "cached": cached})
+        display_scores(np.array([r["accuracy"] for r in results]), name, "")
+    return pd.DataFrame(scores)
+
+
+def successive_halving_search(
+    X_train,
+    y_train,
+    model,
+    param_grid,
+    folds=5,
+    n_repeats=3,
+    factor=3,
+    resource="folds",
+    max_resource=None,
+):
+    """
+    Search the best params of a model of get_model in param_grid with successive halving: all the candidates are evaluated with a small resource,
+    only the best 1/factor are kept and evaluated again with factor times more resource, until one candidate is left.
+    The resource is the number of folds (the scores of the folds already evaluated are kept), or an estimator param such as "n_estimators"
+    (the candidates are then evaluated on the first repeat of the folds). All the candidates share the same matrix and folds.
+    Returns the best params and score, the table of the evaluations and the total compute time
+    """
+    start_time = time.time()
+    X = np.asarray(X_train)
+    y = np.asarray(y_train)
+    fold_indices = get_fold_indices(y, folds, n_repeats)
+    candidates = list(ParameterGrid(param_grid))
+    if resource == "folds":
+        max_resource = len(fold_indices)
+    elif max_resource is None:
+        max_resource = get_model(model).get_params()[resource]
+    n_rungs = int(np.ceil(np.log(len(candidates)) / np.log(factor))) + 1
+
+    evaluations = []
+    scores = {i: [] for i in range(len(candidates))}
+    alive = list(range(len(candidates)))
+    for rung in range(n_rungs):
+        amount = max(1, int(max_resource / factor ** (n_rungs - 1 - rung)))
+        for i in alive:
+            estimator = get_model(model).set_params(**candidates[i])
+            if resource == "folds":
+                new_folds = fold_indices[len(scores[i]) : amount]
+                results = (
+                    evaluate_folds(estimator, X, y, new_folds) if new_folds else []
+                )
+                scores[i] += [r["accuracy"] for r in results]
+            else:
+                estimator.set_params(**{resource: amount})
+                results = evaluate_folds(estimator, X, y, fold_indices[:folds])
+                scores[i] = [r["accuracy"] for r in results]
+            evaluations.append(
+                {
+                    "rung": rung,
+                    "params": candidates[i],
+                    "resource": amount,
+                    "accuracy": np.mean(scores[i]),
+                    "std": np.std(scores[i]),
+                    "fit_time": sum(r["fit_time"] for r in results),
+                }
+            )
+        alive = sorted(alive, key=lambda i: np.mean(scores[i]), reverse=True)
+        alive = alive[: int(np.ceil(len(alive) / factor))]
+        print(
+            f"Rung {rung} ({resource} {amount}) : {couleurs.OKBLEU}{len(alive)} candidates kept{couleurs.FIN}"
+        )
+
+    best = alive[0]
+    seconds = time.time() - start_time
+    display_scores(np.array(scores[best]), model, candidates[best])
+    return {
+        "best_params": candidates[best],
+        "best_score": np.mean(scores[best]),
+        "evaluations": pd.DataFrame(evaluations),
+        "seconds": seconds,
+    }
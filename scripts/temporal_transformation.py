@@ -8,25 +8,42 @@
 #                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
 #                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
 #                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
-#      Update: 2022/05/31 18:39:05 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#      Update: 2026/10/18 09:28:49 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
 #                                                                                                                           #
 # ************************************************************************************************************************* #
 
-import math
+import pandas as pd
+import numpy as np
 
 
 def linear_to_cyclic_cos(value, range):
-    return math.cos(value / range * math.pi * 2)
+    return np.cos(np.asarray(value, dtype=float) / range * np.pi * 2)
 
 
 def linear_to_cyclic_sin(value, range):
-    return math.sin(value / range * math.pi * 2)
+    return np.sin(np.asarray(value, dtype=float) / range * np.pi * 2)
 
 
 def cyclic_to_theta(x, y):
-    tmp = math.atan2(y, x)
-    return tmp if tmp >= 0 else tmp + 2 * math.pi
+    tmp = np.arctan2(np.asarray(y, dtype=float), np.asarray(x, dtype=float))
+    return tmp + 2 * np.pi * (tmp < 0)
 
 
 def cyclic_to_radius(x, y):
-    return math.sqrt(y * y + x * x)
+    return np.hypot(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+
+
+cyclic_ranges = {"hour": 24, "month": 12, "dayofweek": 7}
+
+
+def add_cyclic_columns(data, ranges=cyclic_ranges):
+    """
+    Add the cos and sin columns of the cyclic date columns made by add_columns_for_date. Categorical columns are encoded by their codes, missing values give NaN
+    """
+    for column, range in ranges.items():
+        values = data[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.cat.codes.where(values.notna())
+        data[f"{column}_cos"] = linear_to_cyclic_cos(values, range)
+        data[f"{column}_sin"] = linear_to_cyclic_sin(values, range)
+    return data
@@ -8,31 +8,30 @@
 #                                                       +++##+++::::::::::::::       +#+    +:+     +#+     +#+             #
 #                                                         ::::::::::::::::::::       +#+    +#+     +#+     +#+             #
 #                                                         ::::::::::::::::::::       #+#    #+#     #+#     #+#    #+#      #
-#      Update: 2022/06/05 16:27:46 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
+#      Update: 2026/10/18 09:26:02 by Branly, Tran Quoc   ::::::::::::::::::::        ########      ###      ######## .fr   #
 #                                                                                                                           #
 # ************************************************************************************************************************* #
 
-from scipy.cluster.hierarchy import dendrogram
+from scipy.cluster.hierarchy import dendrogram, linkage
+from scipy.spatial.distance import pdist
 import numpy as np
 
+try:
+    import fastcluster
+except ImportError:
+    fastcluster = None
+
+
 # Taken from https://scikit-learn.org/stable/auto_examples/cluster/plot_agglomerative_dendrogram.html
 def plot_dendrogram(model, **kwargs):
     # Create linkage matrix and then plot the dendrogram
 
     # create the counts of samples under each node
-    counts = np.zeros(model.children_.shape[0])
-    n_samples = len(model.labels_)
-    for i, merge in enumerate(model.children_):
-        current_count = 0
-        for child_idx in merge:
-            if child_idx < n_samples:
-                current_count += 1  # leaf node
-            else:
-                current_count += counts[child_idx - n_samples]
-        counts[i] = current_count
-
-    linkage_matrix = np.column_stack([model.children_, model.distances_,
-                                      counts]).astype(float)
+    counts = get_linkage_counts(model.children_, len(model.labels_))
+
+    linkage_matrix = np.column_stack(
+        [model.children_, model.distances_, counts]
+    ).astype(float)
 
     # Plot the corresponding dendrogram
     default_kwargs = dict(leaf_font_size=10)
@@ -40,6 +39,54 @@ def plot_dendrogram(model, **kwargs):
 
     dendrogram(linkage_matrix, **default_kwargs)
 
+
+def get_linkage_counts(children, n_samples):
+    """
+    Get the number of samples under each merge of children (shape (n_samples - 1, 2)), in one pass over the merges in order
+    """
+    sizes = [1] * n_samples
+    for left, right in np.asarray(children).tolist():
+        sizes.append(sizes[left] + sizes[right])
+    return np.array(sizes[n_samples:], dtype=float)
+
+
+def compute_linkage(
+    X, method="ward", metric="euclidean", max_samples=None, random_state=42
+):
+    """
+    Compute the linkage matrix of a hierarchical clustering of X without building a sklearn model.
+    fastcluster is used if installed, with O(n) memory for ward, single, centroid and median on euclidean observations.
+    Else scipy computes the condensed distances (n * (n - 1) / 2 values) and uses the nearest-neighbor chain algorithm.
+    If max_samples is given, a random sample of X is clustered. Returns the linkage matrix and the indices of the clustered rows
+    """
+    X = np.asarray(X, dtype=float)
+    indices = np.arange(len(X))
+    if max_samples is not None and len(X) > max_samples:
+        rng = np.random.default_rng(random_state)
+        indices = np.sort(rng.choice(len(X), max_samples, replace=False))
+        X = X[indices]
+
+    if (
+        fastcluster is not None
+        and metric == "euclidean"
+        and method in ["ward", "single", "centroid", "median"]
+    ):
+        return fastcluster.linkage_vector(X, method=method), indices
+    distances = pdist(X, metric=metric)
+    if fastcluster is not None:
+        return fastcluster.linkage(distances, method=method), indices
+    return linkage(distances, method=method), indices
+
+
+def plot_linkage_dendrogram(linkage_matrix, p=30, truncate_mode="lastp", **kwargs):
+    """
+    Plot the dendrogram of a linkage matrix, truncated to its last p merges by default to stay readable on large samples
+    """
+    default_kwargs = dict(leaf_font_size=10, p=p, truncate_mode=truncate_mode)
+    default_kwargs.update(kwargs or {})
+    return dendrogram(linkage_matrix, **default_kwargs)
+
+
 def numeric_categorical_attributs_split(data):
     """
     Returns the column names splitted by numerical and categorical columns